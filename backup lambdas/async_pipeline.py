@@ -0,0 +1,135 @@
+# asyncio engine for indexing one commit range (PIPELINE_ENGINE=asyncio).
+#
+# botocore has no native asyncio support, so each AWS call still runs on a
+# worker thread and asyncio only schedules them. At most ASYNC_CONCURRENCY
+# calls are in flight at any time. Difference pages go through a bounded
+# queue, so the pager stops once ASYNC_PAGE_QUEUE pages are waiting. The
+# blobs of the pages being diffed are fetched and parsed side by side, one
+# blob per task, and each phase of the index writes is sent concurrently.
+# Selection, diffing, planning and the write batches themselves are shared
+# with the synchronous engine, so both leave the index in the same state.
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import automatedscript_ostrum as pipeline
+from function_index import batch_write_index, bump_index_version
+from mutation_plan import (
+    clear_plan, plan_is_empty, plan_writes, print_writes, read_plan_state, transact_chunk, transaction_chunks,
+    writes_are_empty
+)
+
+ASYNC_CONCURRENCY = int(os.environ.get('ASYNC_CONCURRENCY', '16'))
+ASYNC_PAGE_QUEUE = int(os.environ.get('ASYNC_PAGE_QUEUE', '2'))
+
+# Pages diffed at the same time; their blob fetches share the concurrency bound
+ASYNC_PAGE_WORKERS = 2
+
+INDEX_BATCH_SIZE = 25
+
+
+def _bounded_runner(executor, semaphore):
+    loop = asyncio.get_running_loop()
+
+    async def run(function, *args):
+        async with semaphore:
+            return await loop.run_in_executor(executor, partial(function, *args))
+
+    return run
+
+async def parse_blobs_async(run, codecommit_repo_name, missing, event_cache=None):
+    # Each blob is fetched and parsed by one task and its content dropped right after,
+    # so at most ASYNC_CONCURRENCY templates are held in memory at once
+    blob_ids = list(missing)
+    results = await asyncio.gather(
+        *(run(pipeline.load_blob_resources, codecommit_repo_name, missing[blob_id], blob_id, event_cache)
+          for blob_id in blob_ids),
+        return_exceptions=True
+    )
+    parsed = {}
+    for blob_id, result in zip(blob_ids, results):
+        # Fetch errors fail the push, as in the synchronous engine
+        if isinstance(result, BaseException):
+            raise result
+        parsed[blob_id] = result
+    return parsed
+
+async def _produce_pages(run, pages, queue):
+    # queue.put() blocks while the queue is full, which holds back the next get_differences
+    while True:
+        differences = await run(next, pages, None)
+        if differences is None:
+            break
+        await queue.put(differences)
+    for _ in range(ASYNC_PAGE_WORKERS):
+        await queue.put(None)
+
+async def _diff_pages(run, codecommit_repo_name, queue, function_diffs, event_cache):
+    while True:
+        differences = await queue.get()
+        if differences is None:
+            return
+        changed_files = pipeline.select_changed_templates(differences)
+        parsed, missing = pipeline.lookup_parsed_templates(changed_files, event_cache)
+        # Parsing runs off the event loop so the other page's fetches keep being issued
+        parsed.update(await parse_blobs_async(run, codecommit_repo_name, missing, event_cache))
+        # Pages never share a path, so merging them in completion order is safe
+        function_diffs.update(pipeline.diff_templates(changed_files, parsed))
+
+async def apply_content_changes_async(run, function_diffs):
+    plan = pipeline.build_mutation_plan(function_diffs)
+    if plan_is_empty(plan):
+        return
+
+    if not pipeline.INDEX_DRY_RUN:
+        await asyncio.gather(*(
+            run(pipeline.ensure_handler_table, table_name)
+            for table_name in sorted({table_name for table_name, _ in plan['additions']})
+        ))
+
+    writes = plan_writes(plan, await run(read_plan_state, plan))
+    removal_actions, addition_actions, index_puts, index_deletes = writes
+    if pipeline.INDEX_DRY_RUN:
+        print_writes(writes)
+        clear_plan(plan)
+        return
+    if writes_are_empty(writes):
+        print("Index already up to date, nothing to write")
+        clear_plan(plan)
+        return
+
+    # An item appears once per phase, so the transactions of a phase cannot conflict
+    for actions in (removal_actions, addition_actions):
+        await asyncio.gather(*(run(transact_chunk, chunk) for chunk in transaction_chunks(actions)))
+
+    await asyncio.gather(
+        *(run(batch_write_index, index_puts[start:start + INDEX_BATCH_SIZE], ())
+          for start in range(0, len(index_puts), INDEX_BATCH_SIZE)),
+        *(run(batch_write_index, (), index_deletes[start:start + INDEX_BATCH_SIZE])
+          for start in range(0, len(index_deletes), INDEX_BATCH_SIZE))
+    )
+
+    await run(bump_index_version)
+
+    print(f"Flushed {len(removal_actions)} removal and {len(addition_actions)} addition item updates")
+    clear_plan(plan)
+
+async def _index_commit_range(codecommit_repo_name, before_commit_id, after_commit_id, event_cache):
+    with ThreadPoolExecutor(max_workers=ASYNC_CONCURRENCY) as executor:
+        run = _bounded_runner(executor, asyncio.Semaphore(ASYNC_CONCURRENCY))
+        queue = asyncio.Queue(maxsize=ASYNC_PAGE_QUEUE)
+        pages = pipeline.iter_difference_pages(codecommit_repo_name, before_commit_id, after_commit_id)
+        function_diffs = {}
+
+        await asyncio.gather(
+            _produce_pages(run, pages, queue),
+            *(_diff_pages(run, codecommit_repo_name, queue, function_diffs, event_cache)
+              for _ in range(ASYNC_PAGE_WORKERS))
+        )
+
+        # Applied as one plan for the same reason as in index_commit_range
+        await apply_content_changes_async(run, function_diffs)
+
+def index_commit_range_async(codecommit_repo_name, before_commit_id, after_commit_id, event_cache=None):
+    asyncio.run(_index_commit_range(codecommit_repo_name, before_commit_id, after_commit_id, event_cache))
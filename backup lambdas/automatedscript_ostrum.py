@@ -1,117 +1,206 @@
-import boto3
-import botocore
-import difflib
-import re
-import yaml
+import json
 import os
+import time
+
+from aws_metrics import emit_metrics, reset_metrics
+from checkpoints import (
+    CHECKPOINT_CLAIM_WAIT, CheckpointBusy, claim_checkpoint, complete_checkpoint, is_processed, read_checkpoint,
+    release_checkpoint
+)
+from handler_tables import create_table, does_table_exist
+from mutation_plan import flush_mutation_plan, new_mutation_plan, plan_is_empty, plan_registration, plan_removal
+from rate_limiter import limiter_stats, reset_limiter_stats
+from repository_sources import UnreadableBlob, get_source
+from template_cache import cache_stats, get_content, get_resources, put_content, put_resources, reset_cache_stats
+from template_diff import diff_is_empty, diff_template_functions, template_folder_name
+
+# 'sync' (default) or 'asyncio', which overlaps paging, fetching and index writes
+PIPELINE_ENGINE = os.environ.get('PIPELINE_ENGINE', 'sync')
+
+# Print the index writes each push would make instead of making them; checkpoints are left alone too
+INDEX_DRY_RUN = os.environ.get('INDEX_DRY_RUN', 'false').lower() == 'true'
+
+# Which changed paths are templates; everything else is dropped before any blob is fetched.
+# Roots are path prefixes (empty means the whole repository); globs without a '/' match the file name.
+TEMPLATE_ROOTS = [root.strip('/') + '/' for root in os.environ.get('TEMPLATE_ROOTS', '').split(',') if root.strip('/')]
+TEMPLATE_INCLUDE = [glob for glob in os.environ.get('TEMPLATE_INCLUDE', '*.yml,*.yaml').split(',') if glob]
+TEMPLATE_EXCLUDE = [glob for glob in os.environ.get('TEMPLATE_EXCLUDE', '').split(',') if glob]
+
+
+def _matches_any(file_path, globs):
+    from fnmatch import fnmatchcase
+
+    file_path = file_path.lower()
+    file_name = file_path.rsplit('/', 1)[-1]
+    return any(fnmatchcase(file_path if '/' in glob else file_name, glob.lower()) for glob in globs)
+
+def is_template_path(file_path):
+    if not file_path:
+        return False
+    if TEMPLATE_ROOTS and not file_path.startswith(tuple(TEMPLATE_ROOTS)):
+        return False
+    return _matches_any(file_path, TEMPLATE_INCLUDE) and not _matches_any(file_path, TEMPLATE_EXCLUDE)
+
+def get_blob_content(codecommit_repo_name, blob_id):
+    return get_source(codecommit_repo_name).blob_content(blob_id)
+
+def new_event_cache():
+    # Shared by every ref of one event so each blob is fetched and parsed once. Template
+    # content is dropped as soon as it is parsed, so only the small reduced maps accumulate.
+    return {
+        # blob_id -> reduced 'Resources' map (see cfn_yaml.load_handler_resources)
+        'resources': {}
+    }
+
+def iter_blobs(codecommit_repo_name, blob_ids):
+    # Yields (blob_id, content) one blob at a time, so a push holds only the blobs being
+    # fetched in memory instead of all of them. Content is None for blobs that cannot be a
+    # template (binary, oversized); fetch errors are raised so the push fails and is retried.
+    to_fetch = []
+    # Blob IDs are content hashes, so anything fetched by an earlier invocation is still valid
+    for blob_id in dict.fromkeys(blob_id for blob_id in blob_ids if blob_id):
+        content = get_content(blob_id)
+        if content is None:
+            to_fetch.append(blob_id)
+        else:
+            yield blob_id, content
+
+    for blob_id, content in get_source(codecommit_repo_name).iter_blob_contents(to_fetch):
+        if content is not None:
+            put_content(blob_id, content)
+        yield blob_id, content
+
+def iter_difference_pages(codecommit_repo_name, before_commit_id, after_commit_id):
+    # Yields lists of differences shaped like CodeCommit's get_differences, page by page
+    return get_source(codecommit_repo_name).difference_pages(before_commit_id, after_commit_id)
+
+def cached_resources(blob_id, event_cache=None):
+    if event_cache is not None and blob_id in event_cache['resources']:
+        return event_cache['resources'][blob_id]
+
+    resources = get_resources(blob_id)
+    if resources is not None and event_cache is not None:
+        event_cache['resources'][blob_id] = resources
+    return resources
+
+def parse_resources(file_path, blob_id, content, event_cache=None):
+    # Returns the template's reduced 'Resources' map, or None when it cannot be parsed
+    if content is None:
+        print(f"Failed to parse file {file_path}: blob is not a readable template")
+        return None
+    resources = extract_resource_names(content)
+    if not isinstance(resources, dict):
+        print(f"Failed to parse file {file_path}: {resources}")
+        return None
 
-# Initialize the AWS CodeCommit client
-client = boto3.client('codecommit')
-dynamodb = boto3.client('dynamodb')
-
-
-def get_added_and_removed_content(codecommit_repo_name, before_commit_id, after_commit_id):
-    added_content = {}
-    removed_content = {}
-    newfile_content = {}
-
-    try:
-        differences = client.get_differences(
-            repositoryName=codecommit_repo_name,
-            beforeCommitSpecifier=before_commit_id,
-            afterCommitSpecifier=after_commit_id
-        )['differences']
+    put_resources(blob_id, resources)
+    if event_cache is not None:
+        event_cache['resources'][blob_id] = resources
+    return resources
+
+def select_changed_templates(differences):
+    # Returns [(file_path, before_blob_id, after_blob_id)] for the templates among the differences
+    changed_files = []
+    for diff in differences:
+        before_blob = diff.get('beforeBlob') or {}
+        after_blob = diff.get('afterBlob') or {}
+
+        # Each side only counts when its path is a template, so renames in or out of scope
+        # behave like additions or deletions
+        before_blob_id = before_blob.get('blobId') if is_template_path(before_blob.get('path')) else None
+        after_blob_id = after_blob.get('blobId') if is_template_path(after_blob.get('path')) else None
+        file_path = after_blob.get('path') if after_blob_id else before_blob.get('path')
+
+        # Identical blobs cannot declare different functions
+        if before_blob_id == after_blob_id:
+            continue
 
-        for diff in differences:
-            file_path = diff.get('afterBlob', {}).get('path', '')
+        # A missing blob on either side is an added or a deleted template
+        changed_files.append((file_path, before_blob_id, after_blob_id))
+
+    return changed_files
+
+def lookup_parsed_templates(changed_files, event_cache=None):
+    # Returns (blob_id -> cached Resources, blob_id -> file path of the blobs that still have to be fetched)
+    parsed = {}
+    missing = {}
+    for file_path, before_blob_id, after_blob_id in changed_files:
+        for blob_id in (before_blob_id, after_blob_id):
+            if blob_id and blob_id not in parsed and blob_id not in missing:
+                resources = cached_resources(blob_id, event_cache)
+                if resources is not None:
+                    parsed[blob_id] = resources
+                else:
+                    missing[blob_id] = file_path
+    return parsed, missing
 
-            if not file_path:
-                continue
+def load_blob_resources(codecommit_repo_name, file_path, blob_id, event_cache=None):
+    # Fetches and parses a single blob; fetch errors are raised to the caller
+    content = get_content(blob_id)
+    if content is None:
+        try:
+            content = get_blob_content(codecommit_repo_name, blob_id)
+        except UnreadableBlob as e:
+            print(f"Unreadable blob {blob_id}: {str(e)}")
+        else:
+            put_content(blob_id, content)
+    return parse_resources(file_path, blob_id, content, event_cache)
+
+def parse_blobs(codecommit_repo_name, missing, event_cache=None):
+    # Returns blob_id -> Resources (None when unparseable) for the blobs that could be fetched;
+    # each blob is parsed as soon as it arrives and its content released before the next one
+    return {
+        blob_id: parse_resources(missing[blob_id], blob_id, content, event_cache)
+        for blob_id, content in iter_blobs(codecommit_repo_name, missing)
+    }
+
+def diff_templates(changed_files, parsed):
+    # Returns file_path -> function diff (see template_diff) for every template whose functions changed
+    function_diffs = {}
+    for file_path, before_blob_id, after_blob_id in changed_files:
+        sides = []
+        for blob_id in (before_blob_id, after_blob_id):
+            if blob_id is None:
+                sides.append(None)
+            elif blob_id in parsed:
+                sides.append(parsed[blob_id])
+            else:
+                # Skipping it would let the checkpoint move past functions never indexed
+                raise LookupError(f"Blob {blob_id} of {file_path} was not fetched")
 
-            try:
-                file_exists_response = client.get_file(
-                repositoryName=codecommit_repo_name,
-                commitSpecifier=after_commit_id,
-                filePath=file_path
-                )
-                
-                after_response = client.get_file(
-                    repositoryName=codecommit_repo_name,
-                    commitSpecifier=after_commit_id,
-                    filePath=file_path
-                )
-                after_content = after_response['fileContent'].decode('utf-8').splitlines()
-                
-                before_response = client.get_file(
-                    repositoryName=codecommit_repo_name,
-                    commitSpecifier=before_commit_id,
-                    filePath=file_path
-                )
-                before_content = before_response['fileContent'].decode('utf-8').splitlines()
-                
-                diff = difflib.unified_diff(before_content, after_content, lineterm='', fromfile='Before', tofile='After')
-                
-                added_changes = []
-                removed_changes = []
-                
-                for line in diff:
-                    if line.startswith('+ '):
-                        added_changes.append(line[2:])
-                    elif line.startswith('- '):
-                        removed_changes.append(line[2:])
-                
-                if added_changes:
-                    added_content[file_path] = added_changes
-                if removed_changes:
-                    removed_content[file_path] = removed_changes
-               
-            except botocore.exceptions.ClientError as e:
-                if e.response['Error']['Code'] == 'FileDoesNotExistException':
-                    # File does not exist in the repository at after_commit_id, so it's newly added
-                    newfile_content[file_path] = []
-                else:
-                    print(f"Error processing file {file_path}: {str(e)}")
+        # A template that no longer parses keeps its functions indexed until it parses again
+        if after_blob_id and sides[1] is None:
+            continue
+        if before_blob_id and sides[0] is None:
+            # What it declared while broken is unknown, so its functions are registered against
+            # the current index (registering is idempotent); stale ones need a rebuild to go
+            print(f"Template {file_path} did not parse before this change, registering its functions; "
+                  f"rebuild_index.py --prune removes any it no longer declares")
 
-        return added_content, removed_content, newfile_content
+        function_diff = diff_template_functions(*sides)
+        if not diff_is_empty(function_diff):
+            function_diffs[file_path] = function_diff
 
-    except botocore.exceptions.ClientError as e:
-        print(f"Error getting differences: {str(e)}")
-        return None, None
+    return function_diffs
 
-def find_function_names(changed_files):
-    function_names = {}  # Use a dictionary to store file names and their associated function names
+def diff_changed_files(codecommit_repo_name, differences, event_cache=None):
+    changed_files = select_changed_templates(differences)
 
-    for file_name, content_changes in changed_files.items():
-        unique_function_names = set()  # Use a set to store unique function names for each file
+    # Templates parsed before need neither their content nor another parse
+    parsed, missing = lookup_parsed_templates(changed_files, event_cache)
+    parsed.update(parse_blobs(codecommit_repo_name, missing, event_cache))
 
-        for line in content_changes:
-            matches = re.findall(r'FunctionName:\s*(\S+)', line)
-            if matches:
-                # Extract function names using regular expression and add them to the set
-                unique_function_names.update(matches)
+    return diff_templates(changed_files, parsed)
 
-        # Update the dictionary with the file name and associated function names
-        function_names[file_name] = list(unique_function_names)
+def iter_template_changes(codecommit_repo_name, before_commit_id, after_commit_id, event_cache=None):
+    # Yields the function diffs of each page of differences
+    for differences in iter_difference_pages(codecommit_repo_name, before_commit_id, after_commit_id):
+        yield diff_changed_files(codecommit_repo_name, differences, event_cache)
 
-    return function_names
-    
 def get_previous_commit_id(repository_name, branch_name, commit_id):
-    # Get information about the current commit
-    response = client.get_commit(
-        repositoryName=repository_name,
-        commitId=commit_id
-    )
-
-    # Check if there are parent commits
-    if 'parents' in response['commit'] and len(response['commit']['parents']) > 0:
-        # Return the commit ID of the first parent, which is the previous commit
-        return response['commit']['parents'][0]
-    else:
-        # There are no parent commits, so this is either the initial commit or an error
-        return None
-def is_yaml_file(file_path):
-    return file_path.lower().endswith(('.yml', '.yaml'))
-    
+    # Returns the first parent of the commit, or None for the initial commit
+    return get_source(repository_name).parent_commit(commit_id)
+
 # def extract_filename(file_path):
 #     # Normalize the file path to handle different separators and formats
 #     file_path = os.path.normpath(file_path)
@@ -124,428 +213,194 @@ def is_yaml_file(file_path):
 #         if part.endswith(('.yml', '.yaml')):
 #             return part
 
-def read_file_content(codecommit_repo_name, commitSpecifier, file_path):
-    codecommit = boto3.client('codecommit')
-
-    try:
-        if is_yaml_file(file_path):
-            response = codecommit.get_file(
-                repositoryName=codecommit_repo_name,
-                commitSpecifier=commitSpecifier,
-                filePath=file_path
-            )
-    
-            # Extract the content from the response as bytes
-            file_content_bytes = response['fileContent']
-    
-            # Decode the base64-encoded bytes content to a string
-            file_content = file_content_bytes.decode('utf-8')
-    
-            return file_content
-    
-    except Exception as e:
-        # Handle exceptions if the file cannot be read
-        return str(e)
-    
 def extract_resource_names(yaml_content):
     try:
-        # Parse the YAML content
-        parsed_yaml = yaml.safe_load(yaml_content)
+        # Imported here so pushes without template changes never load PyYAML
+        from cfn_yaml import load_handler_resources
 
-        # Assuming the resources are under a 'Resources' key
-        resources = parsed_yaml.get('Resources', {})
-
-        return resources  # Return the entire 'Resources' dictionary
+        # Only Handler and FunctionName under 'Resources' are read, straight from the parser's
+        # events, so the template is never built as a tree
+        return load_handler_resources(yaml_content)
     except Exception as e:
         return str(e)
 
-def content_empty(removed_content):
-    for key, value in removed_content.items():
-        if value and any(val.strip() for val in value):
-            return False
-    return True
-
-def extract_function_names(removed_content):
-    function_names = []
-    for content in removed_content:
-        # Split the content by lines and iterate through each line
-        for line in removed_content[content]:
-            # Check if the line contains 'FunctionName' and extract the value
-            if 'FunctionName' in line:
-                # Extract the function name (assuming it's after 'FunctionName:')
-                function_name = line.split(':')[-1].strip()
-                function_names.append(function_name)
-
-    return function_names
-
-def does_table_exist(table_name):
-    try:
-        dynamodb.describe_table(TableName=table_name)
-        return True
-    except dynamodb.exceptions.ResourceNotFoundException:
-        return False
-        
-def create_table(table_name):
-    try:
-        dynamodb.create_table(
-            TableName=table_name,
-            KeySchema=[
-                {
-                    'AttributeName': 'file_name',
-                    'KeyType': 'HASH'
-                }
-            ],
-            AttributeDefinitions=[
-                {
-                    'AttributeName': 'file_name',
-                    'AttributeType': 'S'
-                }
-            ],
-            ProvisionedThroughput={
-                'ReadCapacityUnits': 5,
-                'WriteCapacityUnits': 5
-            }
-        )
-        return {
-            'statusCode': 200,
-            'body': 'Table created successfully'
-        }
-    except Exception as e:
-        print("reason:", e)
-        return {
-            'statusCode': 500,
-            'body': 'Error occurred while creating the table'
-        }
-def create_item(table_name, file_name, folder_name, function_name):
-    try:
-        # Create the item
-        response = dynamodb.put_item(
-            TableName=table_name,
-            Item={
-                'file_name': {'S': file_name},
-                'folder_name': {'S': folder_name},
-                'function_name': {'S': function_name}
-            }
-        )
-        return {
-            'statusCode': 200,
-            'body': 'Item created successfully'
-        }
-    except Exception as e:
-        print("reason:", e)
-        return {
-            'statusCode': 500,
-            'body': 'Error occurred while creating the item'
-        }
-def does_file_exist(table_name, file_name):
-    try:
-        response = dynamodb.get_item(
-            TableName=table_name,
-            Key={'file_name': {'S': file_name}}
-        )
-        return 'Item' in response
-    except dynamodb.exceptions.ResourceNotFoundException:
-        return False
-        
-def add_function_to_file_name_item(table_name, file_name, function_name):
-    # Step 1: Retrieve current function names from DynamoDB item
-    response = dynamodb.get_item(
-        TableName=table_name,
-        Key={'file_name': {'S': file_name}},
-        ProjectionExpression='function_name'
-    )
-
-    # Initialize the list of function names
-    existing_functions = ""
-
-    # Check if the item exists and contains function names
-    if 'Item' in response:
-        existing_functions = response['Item'].get('function_name', {}).get('S', "")
-
-    # Step 2: Append the new function name to the existing list
-    if existing_functions:
-        updated_functions = f"{existing_functions},{function_name}"
-    else:
-        updated_functions = function_name
-
-    # Step 3: Update the DynamoDB item with the updated list
-    dynamodb.update_item(
-        TableName=table_name,
-        Key={'file_name': {'S': file_name}},
-        UpdateExpression='SET #function_name = :function_name',
-        ExpressionAttributeNames={'#function_name': 'function_name'},
-        ExpressionAttributeValues={':function_name': {'S': updated_functions}}
-    )
-def function_exists(table_name, file_name, function_name):
-    try:
-        response = dynamodb.get_item(
-            TableName=table_name,
-            Key={'file_name': {'S': file_name}},
-            ProjectionExpression='function_name'
-        )
-
-        # Check if the item exists and contains function names
-        if 'Item' in response:
-            existing_functions = response['Item'].get('function_name', {}).get('S', "")
-            return function_name in existing_functions.split(',')
-
-        return False
-    except dynamodb.exceptions.ResourceNotFoundException:
-        return False
-    except Exception as e:
-        print("reason:", e)
-        return False
-def remove_function_from_items(search_value):
-    dynamodb = boto3.client('dynamodb')
-    function_name_attribute_name = 'function_name'
-    file_name_attribute_name = 'file_name'
+def plan_function_diff(plan, file_path, function_diff):
+    folder_name = template_folder_name(file_path)
+
+    removals = list(function_diff['removed'])
+    additions = list(function_diff['added'])
+    for function_name, old_table_name, new_table_name in function_diff['changed']:
+        # The handler moved, so the function moves to the other handler table
+        removals.append((function_name, old_table_name))
+        additions.append((function_name, new_table_name))
+    for old_name, new_name, old_table_name, new_table_name in function_diff['renamed']:
+        print(f"Function '{old_name}' renamed to '{new_name}' in {file_path}")
+        removals.append((old_name, old_table_name))
+        additions.append((new_name, new_table_name))
+
+    # Handler tables are keyed by the handler module, so table and item share the name
+    for function_name, table_name in removals:
+        plan_removal(plan, table_name, table_name, function_name)
+    for function_name, table_name in additions:
+        plan_registration(plan, table_name, table_name, folder_name, function_name)
+
+def build_mutation_plan(function_diffs):
+    plan = new_mutation_plan()
+    for file_path, function_diff in function_diffs.items():
+        plan_function_diff(plan, file_path, function_diff)
+    return plan
+
+def ensure_handler_table(table_name):
+    if not does_table_exist(table_name):
+        # Create the table if it doesn't exist; returns once it is ACTIVE
+        create_table(table_name)
+        print(f"Table '{table_name}' created successfully")
+
+def apply_content_changes(function_diffs):
+    # Every registration and removal is collected first and written in bulk at the end
+    plan = build_mutation_plan(function_diffs)
+    if plan_is_empty(plan):
+        return
+
+    if not INDEX_DRY_RUN:
+        for table_name in sorted({table_name for table_name, _ in plan['additions']}):
+            ensure_handler_table(table_name)
+
+    flush_mutation_plan(plan, dry_run=INDEX_DRY_RUN)
+
+
+def index_commit_range(codecommit_repo_name, before_commit_id, after_commit_id, event_cache=None):
+    # Pages only carry function names, so the whole range is applied as one plan; a
+    # function moved between templates on different pages then nets out instead of
+    # being removed after it was re-added
+    function_diffs = {}
+    for page in iter_template_changes(codecommit_repo_name, before_commit_id, after_commit_id, event_cache):
+        function_diffs.update(page)
+    apply_content_changes(function_diffs)
+
+def coalesce_push_refs(event):
+    # Groups every reference of every record by (repository, ref), keeping commits in push order
+    pushes = {}
+    for record in event['Records']:
+        repository = record['eventSourceARN'].split(':')[5]
+        for reference in record['codecommit']['references']:
+            if reference.get('deleted'):
+                # A deleted branch has nothing new to index
+                continue
+            pushes.setdefault((repository, reference['ref']), []).append(reference['commit'])
+    return pushes
+
+def claim_branch(repository, branch_name, commit_id, checkpoint):
+    # Returns the claimed checkpoint, or None when the head is already covered. Another
+    # invocation's lease is waited out, since that invocation only applies its own head
+    deadline = time.monotonic() + CHECKPOINT_CLAIM_WAIT
+    delay = 0.5
+    while True:
+        if is_processed(checkpoint, commit_id):
+            print(f"{repository} {branch_name} already processed up to {commit_id}")
+            return None
+        if checkpoint['commit_id'] and get_source(repository).is_ancestor(commit_id, checkpoint['commit_id']):
+            # A push delivered late, after a later one was applied; diffing it would run backwards
+            print(f"{repository} {branch_name} already processed past {commit_id}")
+            return None
+        if claim_checkpoint(repository, branch_name, commit_id, checkpoint):
+            return checkpoint
+
+        if time.monotonic() + delay > deadline:
+            raise CheckpointBusy(f"{repository} {branch_name} is still being processed by another invocation")
+        print(f"{repository} {branch_name} is being processed by another invocation, retrying in {delay}s")
+        time.sleep(delay)
+        delay = min(delay * 2, 8)
+        checkpoint = read_checkpoint(repository, branch_name)
+
+def process_push(repository, ref, commits, event_cache):
+    branch_name = ref.split('heads/')[-1]
+    commit_id = commits[-1]
+
+    checkpoint = read_checkpoint(repository, branch_name)
+    # A dry run still diffs from the checkpoint but never claims or advances it
+    claimed = checkpoint is not None and not INDEX_DRY_RUN
+    if claimed:
+        checkpoint = claim_branch(repository, branch_name, commit_id, checkpoint)
+        if checkpoint is None:
+            return 'skipped'
 
-    # List all DynamoDB tables
-    table_names = dynamodb.list_tables()['TableNames']
+    try:
+        if checkpoint is not None and checkpoint['commit_id']:
+            # Diff from the last processed commit so every commit since then is covered
+            last_commit = checkpoint['commit_id']
+        else:
+            # One range diff covers every commit pushed to this branch in the event
+            last_commit = get_previous_commit_id(repository, branch_name, commits[0])
 
-    for table_name in table_names:
+        if PIPELINE_ENGINE == 'asyncio':
+            # Imported here so the default engine never loads asyncio
+            from async_pipeline import index_commit_range_async
+            index_commit_range_async(repository, last_commit, commit_id, event_cache)
+        else:
+            index_commit_range(repository, last_commit, commit_id, event_cache)
+    except Exception:
+        if claimed:
+            release_checkpoint(repository, branch_name, commit_id)
+        raise
+
+    if claimed:
+        complete_checkpoint(repository, branch_name, commit_id, checkpoint, commits)
+    return 'planned' if INDEX_DRY_RUN else 'processed'
+
+def process_pushes(pushes, outcomes):
+    # pushes maps (repository, ref) -> commits in push order; one outcome per commit is appended
+    event_cache = new_event_cache()
+
+    for (repository, ref), commits in pushes.items():
+        error = None
         try:
-            response = dynamodb.scan(
-                TableName=table_name,
-                FilterExpression='contains(#func_attr, :value)',
-                ExpressionAttributeNames={'#func_attr': function_name_attribute_name},
-                ExpressionAttributeValues={':value': {'S': search_value}}
-            )
-
-            if 'Items' in response and len(response['Items']) > 0:
-                print(f"Found matching items in table {table_name}:")
-                for item in response['Items']:
-                    if file_name_attribute_name in item:
-                        file_name_value = item[file_name_attribute_name]['S']
-                        print(f"File Name: {file_name_value}")
-                        remove_function(table_name, file_name_value, search_value)
-                    print("Item:", item)
-            else:
-                print(f"No matching item found in table {table_name}")
-
+            status = process_push(repository, ref, commits, event_cache)
         except Exception as e:
-            print(f"An error occurred while scanning table {table_name}: {e}")
+            print(f"An error occurred while processing {repository} {ref}: {e}")
+            status = 'failed'
+            error = str(e)
 
-def remove_function(table_name, partition_key_value, value_to_remove):
-    dynamodb = boto3.client('dynamodb')
-    attribute_name = 'function_name'
+        for commit_id in commits:
+            outcome = {'repository': repository, 'ref': ref, 'commit': commit_id, 'status': status}
+            if error is not None:
+                outcome['error'] = error
+            outcomes.append(outcome)
 
-    try:
-        primary_key = {'file_name': {'S': partition_key_value}}
-        response = dynamodb.get_item(TableName=table_name, Key=primary_key)
-
-        if 'Item' in response:
-            item = response['Item']
-
-            if attribute_name in item:
-                comma_separated_string = item[attribute_name]['S']
-                values_list = comma_separated_string.split(',')
-
-                if value_to_remove in values_list:
-                    values_list.remove(value_to_remove)
-                    updated_string = ','.join(values_list)
-
-                    dynamodb.update_item(
-                        TableName=table_name,
-                        Key=primary_key,
-                        UpdateExpression=f'SET {attribute_name} = :updated_string',
-                        ExpressionAttributeValues={':updated_string': {'S': updated_string}}
-                    )
-                    print(f"Removed '{value_to_remove}' from '{attribute_name}' in table {table_name}")
-                else:
-                    print(f"'{value_to_remove}' not found in '{attribute_name}' in table {table_name}")
-            else:
-                print(f"'{attribute_name}' not found in item in table {table_name}")
-        else:
-            print(f"Item not found in table {table_name}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        
-def add_added_content(codecommit_repo_name,commit_id,filenames):
-    
-    for file_name in filenames:
-        parts = file_name.split('/')
-        modified_file_path = parts[-1].split('.')[0]
-        print(f"Modified file: {modified_file_path}")
-        # Attempt to read the file content
-        # modified_file_path = extract_filename(file_name)
-        cloudformation_template = read_file_content(codecommit_repo_name, commit_id, file_name)
-        # print("cloudformation_template",cloudformation_template)
-        if cloudformation_template is None:
-            print(f"Failed to read file: {file_name}")
-            continue
+    return outcomes
 
-        yaml_content = re.sub(r'!(\w+)\s+[^\s]+', 'dummy-value', cloudformation_template)
-        resources = extract_resource_names(yaml_content)
-        print(resources)
-
-        for resource_name, resource_properties in resources.items():
-            print("resource_properties", resource_properties)
-            if 'Handler' in resource_properties.get('Properties', {}):
-                try:
-                    handler_value = resource_properties['Properties']['Handler']
-                    handler_value = handler_value.split('.')[0]
-                    FunctionName = resource_properties['Properties']['FunctionName']
-                    print("FunctionName",FunctionName)
-                    print(f"Resource: {resource_name}, Handler: {handler_value}")
-
-                    # Assuming handler_value is the table name and function_name is the item's function_name
-                    table_name = handler_value
-                    file_name = handler_value
-                    folder_name = modified_file_path
-                    function_name = FunctionName
-
-                    # Check if the table exists
-                    table_exists = does_table_exist(table_name)
-
-                    if not table_exists:
-                        # Create the table if it doesn't exist
-                        create_table(table_name)
-                        time.sleep(8)
-                        print(f"Table '{table_name}' created successfully")
-
-                        # Create the item immediately after table creation
-                        create_item(table_name, file_name, folder_name, function_name)
-                        print(f"Item '{file_name}' inserted successfully")
-
-                    # Check if the file exists
-                    file_exists = does_file_exist(table_name, file_name)
-
-                    if not file_exists:
-                        # Create the item if it doesn't exist
-                        create_item(table_name, file_name, folder_name, function_name)
-                        print(f"Item '{file_name}' inserted successfully")
-                    else:
-                        # Check if the function exists for the file
-                        if not function_exists(table_name, file_name, function_name):
-                            add_function_to_file_name_item(table_name, file_name, function_name)
-                            print(f"Function '{function_name}' added to item '{file_name}' successfully")
-
-                    return {
-                        'statusCode': 200,
-                        'body': 'Operation completed successfully'
-                    }
-
-                except Exception as e:
-                    print("reason:", e)
-                    return {
-                        'statusCode': 500,
-                        'body': 'Error occurred'
-                    }
-        
 def lambda_handler(event, context):
-    print("event",event)
+    reset_metrics()
+    reset_cache_stats()
+    reset_limiter_stats()
+    started = time.perf_counter()
+    outcomes = []
+
     try:
-        # Extract necessary information from the event
-        aws_region = event['Records'][0]['awsRegion']
-        codecommit_repo_arn = event['Records'][0]['eventSourceARN']
-        codecommit_repo_name = codecommit_repo_arn.split(':')[5]
-        branch_name = event['Records'][0]['codecommit']['references'][0]['ref'].split('heads/')[-1]
-        commit_id = event['Records'][0]['codecommit']['references'][0]['commit']
-        repository = event['Records'][0]['eventSourceARN'].split(':')[5]
-
-        # Initialize CodeCommit client
-        codecommit_client = boto3.client('codecommit', region_name=aws_region)
-
-        # Get the last commit
-        last_commit = get_previous_commit_id(repository, branch_name, commit_id)
-
-        # Get added and removed content
-        added_content, removed_content, newfile_content = get_added_and_removed_content(repository, last_commit, commit_id)
-        print("added_content", added_content)
-        print("removed_content", removed_content)
-
-        if not content_empty(removed_content): 
-            function_names_for_remove = extract_function_names(removed_content)
-            for function_name in function_names_for_remove:
-                print("item",function_name)
-                remove_function_from_items(function_name)
-        
-        if not content_empty(added_content):
-
-            function_names = find_function_names(added_content)
-            print("function_names", function_names)
-            filenames = list(function_names.keys())
-            add_added_content(codecommit_repo_name,commit_id,filenames)
-        if newfile_content:
-            filenames = list(newfile_content.keys())
-            print("#########",filenames)
-            add_added_content(codecommit_repo_name,commit_id,filenames)
-            # filenames = list(function_names.keys())
-            # for file_name in filenames:
-            #     parts = file_name.split('/')
-            #     modified_file_path = parts[-1].split('.')[0]
-            #     print(f"Modified file: {modified_file_path}")
-
-            #     # Attempt to read the file content
-            #     cloudformation_template = read_file_content(codecommit_repo_name, commit_id, file_name)
-            #     # print("cloudformation_template",cloudformation_template)
-            #     if cloudformation_template is None:
-            #         print(f"Failed to read file: {file_name}")
-            #         continue
-
-            #     yaml_content = re.sub(r'!(\w+)\s+[^\s]+', 'dummy-value', cloudformation_template)
-            #     resources = extract_resource_names(yaml_content)
-            #     print(resources)
-
-            #     for resource_name, resource_properties in resources.items():
-            #         print("resource_properties", resource_properties)
-            #         if 'Handler' in resource_properties.get('Properties', {}):
-            #             try:
-            #                 handler_value = resource_properties['Properties']['Handler']
-            #                 handler_value = handler_value.split('.')[0]
-            #                 FunctionName = resource_properties['Properties']['FunctionName']
-            #                 print("FunctionName",FunctionName)
-            #                 print(f"Resource: {resource_name}, Handler: {handler_value}")
-
-            #                 # Assuming handler_value is the table name and function_name is the item's function_name
-            #                 table_name = handler_value
-            #                 file_name = handler_value
-            #                 folder_name = modified_file_path
-            #                 function_name = FunctionName
-
-            #                 # Check if the table exists
-            #                 table_exists = does_table_exist(table_name)
-
-            #                 if not table_exists:
-            #                     # Create the table if it doesn't exist
-            #                     create_table(table_name)
-            #                     time.sleep(8)
-            #                     print(f"Table '{table_name}' created successfully")
-
-            #                     # Create the item immediately after table creation
-            #                     create_item(table_name, file_name, folder_name, function_name)
-            #                     print(f"Item '{file_name}' inserted successfully")
-
-            #                 # Check if the file exists
-            #                 file_exists = does_file_exist(table_name, file_name)
-
-            #                 if not file_exists:
-            #                     # Create the item if it doesn't exist
-            #                     create_item(table_name, file_name, folder_name, function_name)
-            #                     print(f"Item '{file_name}' inserted successfully")
-            #                 else:
-            #                     # Check if the function exists for the file
-            #                     if not function_exists(table_name, file_name, function_name):
-            #                         add_function_to_file_name_item(table_name, file_name, function_name)
-            #                         print(f"Function '{function_name}' added to item '{file_name}' successfully")
-
-            #                 return {
-            #                     'statusCode': 200,
-            #                     'body': 'Operation completed successfully'
-            #                 }
-
-            #             except Exception as e:
-            #                 print("reason:", e)
-            #                 return {
-            #                     'statusCode': 500,
-            #                     'body': 'Error occurred'
-            #                 }
+        process_pushes(coalesce_push_refs(event), outcomes)
 
-    except Exception as e:
-        print("An error occurred:", str(e))
+        failed = [outcome for outcome in outcomes if outcome['status'] == 'failed']
+        if failed:
+            # Raised rather than returned as a 500 so the asynchronous invocation is retried;
+            # refs that succeeded are skipped on the retry through their checkpoints
+            raise RuntimeError(f"Failed to process {json.dumps(failed)}")
         return {
-            'statusCode': 500,
-            'body': 'Error occurred'
+            'statusCode': 200,
+            'body': json.dumps(outcomes)
         }
 
+    except Exception as e:
+        print("An error occurred:", str(e))
+        raise
+
+    finally:
+        # One structured record per invocation replaces the old progress prints
+        emit_metrics(
+            properties={
+                'outcomes': outcomes,
+                'handler_ms': round((time.perf_counter() - started) * 1000, 2),
+                'template_cache': cache_stats(),
+                'rate_limiter': limiter_stats()
+            },
+            function_name=getattr(context, 'function_name', None)
+        )
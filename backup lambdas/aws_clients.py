@@ -0,0 +1,71 @@
+# Process-wide registry of boto3 clients, one per (service, region).
+#
+# Clients are thread-safe once built and keep their HTTPS connection pool,
+# so sharing them across modules and warm invocations skips credential and
+# endpoint resolution and reuses open connections. Modules hold LazyClient
+# stand-ins so that importing them does not import boto3. Every client is
+# instrumented for aws_metrics, and DynamoDB clients are paced per table by
+# rate_limiter.
+import os
+import threading
+
+from aws_metrics import instrument_client
+
+# Client-side pacing of DynamoDB calls to the tables' provisioned capacity
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+_clients = {}
+_lock = threading.Lock()
+_client_config = None
+
+
+def _get_client_config():
+    global _client_config
+    if _client_config is None:
+        from botocore.config import Config
+
+        _client_config = Config(
+            # Enough for the blob fetch pool plus the get_differences prefetcher
+            max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '32')),
+            tcp_keepalive=True,
+            connect_timeout=5,
+            read_timeout=30,
+            retries={
+                'mode': 'adaptive',
+                'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+            }
+        )
+    return _client_config
+
+def get_client(service_name, region_name=None):
+    # None means the region of the Lambda itself (AWS_REGION)
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                # boto3 is only imported once a client is actually needed, keeping it off cold starts
+                import boto3
+
+                # The default boto3 session is not safe to build clients from concurrently
+                client = instrument_client(
+                    boto3.client(service_name, region_name=region_name, config=_get_client_config())
+                )
+                if service_name == 'dynamodb' and RATE_LIMIT_ENABLED:
+                    from rate_limiter import instrument_rate_limits
+
+                    instrument_rate_limits(client)
+                _clients[key] = client
+    return client
+
+
+class LazyClient:
+    # Stands in for a module-level client and builds the real one on first attribute access
+
+    def __init__(self, service_name, region_name=None):
+        self._service_name = service_name
+        self._region_name = region_name
+
+    def __getattr__(self, name):
+        return getattr(get_client(self._service_name, self._region_name), name)
@@ -0,0 +1,189 @@
+# Per-invocation AWS API metrics collected through botocore event hooks.
+#
+# Every client built by aws_clients is instrumented: each call is counted per
+# (service, operation) with request/response bytes, a latency histogram,
+# retry attempts, throttling responses and time held back by rate_limiter.
+# emit_metrics() writes everything as one CloudWatch Embedded Metric Format
+# record on stdout, which CloudWatch Logs turns into metrics without any
+# PutMetricData calls.
+import json
+import os
+import threading
+import time
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TemplateIndexer')
+
+# Upper bounds in milliseconds; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+THROTTLING_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'TransactionInProgressException', 'EncryptionKeyThrottledException',
+}
+
+# Per-item reasons of a cancelled DynamoDB transaction that mean the table was throttled
+THROTTLED_CANCELLATION_REASONS = {'ThrottlingError', 'ProvisionedThroughputExceeded'}
+
+# EMF accepts at most 100 values per metric
+MAX_SAMPLES = 100
+
+_lock = threading.Lock()
+_operations = {}
+
+
+def _operation_metrics(service_name, operation_name):
+    key = (service_name, operation_name)
+    metrics = _operations.get(key)
+    if metrics is None:
+        metrics = _operations[key] = {
+            'calls': 0,
+            'errors': 0,
+            'retries': 0,
+            'throttles': 0,
+            'bytes_out': 0,
+            'bytes_in': 0,
+            'latency_ms': [],
+            'retried_latency_ms': 0.0,
+            'wait_ms': 0.0,
+            'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        }
+    return metrics
+
+def is_throttled(response):
+    # response is a parsed error response, e.g. ClientError.response; a transaction cancelled
+    # because one of its items was throttled only says so in its CancellationReasons
+    if response.get('Error', {}).get('Code') in THROTTLING_CODES:
+        return True
+    return any(
+        (reason or {}).get('Code') in THROTTLED_CANCELLATION_REASONS
+        for reason in response.get('CancellationReasons') or ()
+    )
+
+def _split_event_name(event_name):
+    # e.g. 'after-call.dynamodb.UpdateItem'
+    _, service_name, operation_name = event_name.split('.', 2)
+    return service_name, operation_name
+
+def _before_call(context=None, **kwargs):
+    if context is not None:
+        context['metrics_started'] = time.perf_counter()
+
+def _request_created(request=None, event_name='', **kwargs):
+    body = getattr(request, 'body', None)
+    if isinstance(body, (bytes, str)):
+        service_name, operation_name = _split_event_name(event_name)
+        with _lock:
+            _operation_metrics(service_name, operation_name)['bytes_out'] += len(body)
+
+def _after_call(http_response=None, parsed=None, context=None, event_name='', **kwargs):
+    service_name, operation_name = _split_event_name(event_name)
+    started = (context or {}).get('metrics_started')
+    latency_ms = (time.perf_counter() - started) * 1000 if started else None
+    parsed = parsed or {}
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+
+    with _lock:
+        metrics = _operation_metrics(service_name, operation_name)
+        metrics['calls'] += 1
+        metrics['retries'] += retries
+        if 'Error' in parsed:
+            metrics['errors'] += 1
+        if http_response is not None:
+            metrics['bytes_in'] += int(http_response.headers.get('content-length', 0) or 0)
+        if latency_ms is not None:
+            metrics['latency_ms'].append(latency_ms)
+            if retries:
+                metrics['retried_latency_ms'] += latency_ms
+            bucket = next(
+                (index for index, bound in enumerate(LATENCY_BUCKETS_MS) if latency_ms <= bound),
+                len(LATENCY_BUCKETS_MS)
+            )
+            metrics['histogram'][bucket] += 1
+
+def _needs_retry(response=None, event_name='', **kwargs):
+    # Observer only: returning None leaves the retry decision to botocore
+    if not response:
+        return None
+    if is_throttled(response[1] or {}):
+        service_name, operation_name = _split_event_name(event_name)
+        with _lock:
+            _operation_metrics(service_name, operation_name)['throttles'] += 1
+    return None
+
+def record_wait(service_name, operation_name, wait_ms):
+    # Time a call spent waiting for client-side rate limit tokens before it was sent
+    with _lock:
+        _operation_metrics(service_name, operation_name)['wait_ms'] += wait_ms
+
+def instrument_client(client):
+    events = client.meta.events
+    events.register('before-call.*.*', _before_call)
+    events.register('request-created.*.*', _request_created)
+    events.register('after-call.*.*', _after_call)
+    events.register('needs-retry.*.*', _needs_retry)
+    return client
+
+def reset_metrics():
+    with _lock:
+        _operations.clear()
+
+def snapshot_metrics(reset=False):
+    # reset=True starts the next period in the same step, so no call is counted twice or lost
+    with _lock:
+        snapshot = {
+            key: dict(metrics, latency_ms=list(metrics['latency_ms']), histogram=list(metrics['histogram']))
+            for key, metrics in _operations.items()
+        }
+        if reset:
+            _operations.clear()
+        return snapshot
+
+def build_metrics_record(properties=None, function_name=None, reset=False):
+    record = {}
+    definitions = []
+
+    def add_metric(name, value, unit):
+        record[name] = value
+        definitions.append({'Name': name, 'Unit': unit})
+
+    totals = {'calls': 0, 'retries': 0, 'throttles': 0, 'wait_ms': 0.0}
+    operations = {}
+    for (service_name, operation_name), metrics in sorted(snapshot_metrics(reset).items()):
+        prefix = f"{service_name}.{operation_name}"
+        add_metric(f"{prefix}.Calls", metrics['calls'], 'Count')
+        add_metric(f"{prefix}.Retries", metrics['retries'], 'Count')
+        add_metric(f"{prefix}.Throttles", metrics['throttles'], 'Count')
+        add_metric(f"{prefix}.BytesIn", metrics['bytes_in'], 'Bytes')
+        add_metric(f"{prefix}.BytesOut", metrics['bytes_out'], 'Bytes')
+        add_metric(f"{prefix}.RateLimitWait", round(metrics['wait_ms'], 2), 'Milliseconds')
+        if metrics['latency_ms']:
+            add_metric(f"{prefix}.Latency", [round(value, 2) for value in metrics['latency_ms'][:MAX_SAMPLES]], 'Milliseconds')
+        for name in totals:
+            totals[name] += metrics[name]
+        operations[prefix] = {
+            'errors': metrics['errors'],
+            'retried_latency_ms': round(metrics['retried_latency_ms'], 2),
+            'latency_histogram_ms': dict(zip([str(bound) for bound in LATENCY_BUCKETS_MS] + ['+Inf'], metrics['histogram']))
+        }
+
+    add_metric('ApiCalls', totals['calls'], 'Count')
+    add_metric('ApiRetries', totals['retries'], 'Count')
+    add_metric('ApiThrottles', totals['throttles'], 'Count')
+    add_metric('ApiRateLimitWait', round(totals['wait_ms'], 2), 'Milliseconds')
+
+    record['FunctionName'] = function_name or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+    record['operations'] = operations
+    record.update(properties or {})
+    record['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': NAMESPACE,
+            'Dimensions': [['FunctionName']],
+            'Metrics': definitions
+        }]
+    }
+    return record
+
+def emit_metrics(properties=None, function_name=None, reset=False):
+    print(json.dumps(build_metrics_record(properties, function_name, reset)))
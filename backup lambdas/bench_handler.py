@@ -0,0 +1,267 @@
+# End-to-end benchmark of lambda_handler against in-memory AWS fakes.
+#
+#   python bench_handler.py [--scenario small,medium,large] [--latency-ms 0]
+#   python bench_handler.py --templates 500 --functions 8 --churn 0.05
+#   python bench_handler.py --scenario large --latency-ms 5 --engine sync,asyncio
+#   python bench_handler.py --scenario large --source git
+#
+# Each scenario builds a synthetic repository (N templates with M functions
+# each), indexes its first commit, then pushes a second commit with the
+# given churn (renamed, removed and new functions plus unrelated source
+# changes) and measures that push: wall time, API calls per service and
+# operation, and peak traced memory. It also checks the resulting index
+# against the functions actually defined at the pushed commit. With several
+# engines, the index each one leaves behind must be identical. With
+# --source git the repository is a real local git repository read through
+# repository_sources.GitSource instead of the CodeCommit fake.
+import argparse
+import contextlib
+import io
+import os
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import fake_aws
+
+SCENARIOS = {
+    'small': {'templates': 20, 'functions': 5, 'churn': 0.10},
+    'medium': {'templates': 200, 'functions': 10, 'churn': 0.05},
+    'large': {'templates': 1000, 'functions': 10, 'churn': 0.02},
+}
+
+REPOSITORY = 'bench-repo'
+
+WRITE_OPERATIONS = ('PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems')
+HANDLERS = 25
+
+
+def render_template(functions):
+    lines = ["AWSTemplateFormatVersion: '2010-09-09'", "Transform: AWS::Serverless-2016-10-31", "Resources:"]
+    for index, (function_name, handler) in enumerate(functions):
+        lines.extend([
+            f"  Function{index}:",
+            "    Type: AWS::Serverless::Function",
+            "    Properties:",
+            f"      FunctionName: {function_name}",
+            f"      Handler: {handler}.lambda_handler",
+            "      Runtime: python3.11",
+            "      Role: !GetAtt LambdaRole.Arn",
+            "      Environment:",
+            "        Variables:",
+            "          STAGE: !Sub '${Stage}-api'",
+        ])
+    return '\n'.join(lines) + '\n'
+
+def synthetic_repository(templates, functions, churn, seed=0):
+    # Returns (base_files, head_files, head_functions) where *_functions maps template path -> [(name, handler)]
+    rng = random.Random(seed)
+    base = {}
+    for template in range(templates):
+        path = f"stacks/stack{template}/template.yml"
+        base[path] = [
+            (f"stack{template}-fn{function}", f"handler{(template * functions + function) % HANDLERS}")
+            for function in range(functions)
+        ]
+
+    head = {path: list(entries) for path, entries in base.items()}
+    changes = max(1, int(templates * functions * churn))
+    paths = sorted(head)
+    for change in range(changes):
+        entries = head[rng.choice(paths)]
+        if not entries:
+            continue
+        position = rng.randrange(len(entries))
+        name, handler = entries[position]
+        action = change % 3
+        if action == 0:
+            entries[position] = (f"{name}-v2", handler)
+        elif action == 1:
+            entries.pop(position)
+        else:
+            entries.append((f"new{change}", f"handler{rng.randrange(HANDLERS)}"))
+
+    base_files = {path: render_template(entries) for path, entries in base.items()}
+    head_files = {path: render_template(entries) for path, entries in head.items()}
+
+    # Unrelated churn the indexer should not care about
+    for source in range(templates // 2):
+        base_files[f"src/module{source}.py"] = f"VALUE = {source}\n"
+        head_files[f"src/module{source}.py"] = f"VALUE = {source + (source % 4 == 0)}\n"
+
+    return base_files, head_files, head
+
+def git_commit(work_tree, files, message):
+    # Replaces the work tree's content with files and returns the new commit ID
+    subprocess.run(['git', '-C', work_tree, 'rm', '-rq', '--ignore-unmatch', '.'], check=True)
+    for path, content in files.items():
+        full_path = os.path.join(work_tree, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as output:
+            output.write(content)
+    subprocess.run(['git', '-C', work_tree, 'add', '-A'], check=True)
+    subprocess.run(
+        ['git', '-C', work_tree, '-c', 'user.name=bench', '-c', 'user.email=bench@example.com',
+         'commit', '-qm', message],
+        check=True
+    )
+    return subprocess.run(['git', '-C', work_tree, 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True).stdout.strip()
+
+def push_event(commit_id, ref='refs/heads/main'):
+    return {
+        'Records': [{
+            'awsRegion': 'us-east-1',
+            'eventSourceARN': f"arn:aws:codecommit:us-east-1:123456789012:{REPOSITORY}",
+            'codecommit': {'references': [{'ref': ref, 'commit': commit_id}]}
+        }]
+    }
+
+def index_state(dynamodb):
+    # Returns the (table_name, function_name) pairs in the handler tables and in the reverse index
+    from function_index import INDEX_TABLE_NAME, is_version_item
+    from handler_tables import read_function_names
+
+    stored = set()
+    for table_name, table in dynamodb.tables.items():
+        if table['key_names'] != ['file_name']:
+            continue
+        for item in table['items'].values():
+            stored.update((table_name, function_name) for function_name in read_function_names(item))
+
+    indexed = {
+        (item['table_name']['S'], item['function_name']['S'])
+        for item in dynamodb.tables.get(INDEX_TABLE_NAME, {'items': {}})['items'].values()
+        if not is_version_item(item)
+    }
+
+    return stored, indexed
+
+def index_mismatches(dynamodb, expected):
+    # Counts functions missing from, or left over in, the handler tables and the reverse index
+    wanted = {
+        (handler, function_name)
+        for entries in expected.values()
+        for function_name, handler in entries
+    }
+    stored, indexed = index_state(dynamodb)
+    return len(wanted ^ stored), len(wanted ^ indexed)
+
+def run_scenario(templates, functions, churn, latency, engine='sync', source='codecommit'):
+    import automatedscript_ostrum
+    import checkpoints
+    import function_index
+    import handler_tables
+    import repository_sources
+    import template_cache
+
+    codecommit, dynamodb = fake_aws.install_fakes(latency=latency)
+    handler_tables._active_tables.clear()
+    template_cache.clear_cache(disk=True)
+    function_index.create_index_table()
+    checkpoints.create_checkpoint_table()
+
+    base_files, head_files, head_functions = synthetic_repository(templates, functions, churn)
+    repository_sources._sources.clear()
+    if source == 'git':
+        git_root = tempfile.TemporaryDirectory()
+        work_tree = os.path.join(git_root.name, REPOSITORY)
+        subprocess.run(['git', 'init', '-q', work_tree], check=True)
+        base_commit = git_commit(work_tree, base_files, 'base')
+        head_commit = git_commit(work_tree, head_files, 'head')
+        repository_sources.REPOSITORY_SOURCE = 'git'
+        repository_sources.GIT_REPOSITORIES_ROOT = git_root.name
+    else:
+        codecommit.add_commit('base', base_files)
+        codecommit.add_commit('head', head_files, parent='base')
+        base_commit, head_commit = 'base', 'head'
+
+    automatedscript_ostrum.PIPELINE_ENGINE = engine
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Index the first commit so the measured push runs against a populated index; its
+        # time is reported too, since it writes every function of the repository
+        tracemalloc.start()
+        start = time.perf_counter()
+        automatedscript_ostrum.lambda_handler(push_event(base_commit), None)
+        initial_elapsed = time.perf_counter() - start
+        _, initial_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        codecommit.calls.clear()
+        dynamodb.calls.clear()
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = automatedscript_ostrum.lambda_handler(push_event(head_commit), None)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Counted before the replay, which calls both services again
+        calls = {'codecommit': dict(codecommit.calls), 'dynamodb': dict(dynamodb.calls)}
+
+        # Replaying the push without its checkpoint re-diffs the same range against an index
+        # that already matches it, which must not write anything
+        checkpoint_items = dynamodb.tables.pop(checkpoints.CHECKPOINT_TABLE_NAME)
+        dynamodb.calls.clear()
+        automatedscript_ostrum.lambda_handler(push_event(head_commit), None)
+        replay_writes = sum(dynamodb.calls.get(operation, 0) for operation in WRITE_OPERATIONS)
+        dynamodb.tables[checkpoints.CHECKPOINT_TABLE_NAME] = checkpoint_items
+        automatedscript_ostrum.PIPELINE_ENGINE = 'sync'
+        repository_sources.REPOSITORY_SOURCE = 'codecommit'
+
+    table_mismatches, index_mismatch_count = index_mismatches(dynamodb, head_functions)
+    return {
+        'status': response['statusCode'] if response else None,
+        'seconds': elapsed,
+        'initial_seconds': initial_elapsed,
+        'initial_peak_mb': initial_peak / 2 ** 20,
+        'peak_mb': peak / 2 ** 20,
+        'codecommit': calls['codecommit'],
+        'dynamodb': calls['dynamodb'],
+        'replay_writes': replay_writes,
+        'table_mismatches': table_mismatches,
+        'index_mismatches': index_mismatch_count,
+        'template_cache': template_cache.cache_stats(),
+        'index_state': index_state(dynamodb),
+    }
+
+def print_result(name, result):
+    print(f"== {name}: status {result['status']}, {result['seconds'] * 1000:.1f} ms, peak {result['peak_mb']:.1f} MB"
+          f" (initial push {result['initial_seconds'] * 1000:.1f} ms, peak {result['initial_peak_mb']:.1f} MB)")
+    for service in ('codecommit', 'dynamodb'):
+        calls = result[service]
+        detail = ', '.join(f"{operation}={count}" for operation, count in sorted(calls.items()))
+        print(f"   {service:<10} {sum(calls.values()):>6} calls  {detail}")
+    stats = ', '.join(f"{name}={value}" for name, value in sorted(result['template_cache'].items()))
+    print(f"   template cache: {stats}")
+    print(f"   index check: {result['table_mismatches']} handler-table and {result['index_mismatches']} reverse-index mismatches")
+    print(f"   replayed push: {result['replay_writes']} dynamodb writes")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', default='small,medium')
+    parser.add_argument('--templates', type=int)
+    parser.add_argument('--functions', type=int, default=10)
+    parser.add_argument('--churn', type=float, default=0.05)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--engine', default='sync', help='comma-separated: sync, asyncio')
+    parser.add_argument('--source', default='codecommit', choices=('codecommit', 'git'))
+    args = parser.parse_args()
+
+    if args.templates:
+        scenarios = {'custom': {'templates': args.templates, 'functions': args.functions, 'churn': args.churn}}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in args.scenario.split(',')}
+
+    for name, scenario in scenarios.items():
+        states = {}
+        for engine in args.engine.split(','):
+            result = run_scenario(latency=args.latency_ms / 1000, engine=engine, source=args.source, **scenario)
+            print_result(f"{name} [{engine}]", result)
+            states[engine] = result['index_state']
+        if len(states) > 1:
+            identical = all(state == next(iter(states.values())) for state in states.values())
+            print(f"   engines leave {'identical' if identical else 'DIFFERENT'} index state")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Cold-start import benchmark for the handler module.
+#
+#   python bench_import_time.py [--module automatedscript_ostrum] [--budget-ms 15]
+#
+# Byte-compiles this directory (deployment packages should ship __pycache__,
+# otherwise every cold start recompiles the sources), then runs
+# `python -X importtime -c "import <module>"` in a fresh interpreter. Fails
+# when the module's cumulative import time exceeds the budget, or when any of
+# the heavy dependencies below is imported eagerly; those must only be loaded
+# once an event actually needs them.
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+
+DEFERRED_MODULES = ('boto3', 'botocore', 'yaml', 'difflib')
+
+
+def parse_importtime(stderr):
+    # Lines look like: "import time:  self [us] | cumulative | imported package"
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings.append((name.strip(), int(self_us), int(cumulative_us)))
+    return timings
+
+def measure(module_name, runs):
+    here = os.path.dirname(os.path.abspath(__file__))
+    compileall.compile_dir(here, quiet=1)
+    samples = []
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+            cwd=here, capture_output=True, text=True, check=True
+        )
+        timings = parse_importtime(result.stderr)
+        top_level = [cumulative for name, _, cumulative in timings if name == module_name]
+        samples.append(top_level[-1])
+    return sorted(samples)[len(samples) // 2], timings
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='automatedscript_ostrum')
+    parser.add_argument('--budget-ms', type=float, default=15.0)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    median_us, timings = measure(args.module, args.runs)
+    print(f"{args.module}: {median_us / 1000:.1f} ms cumulative (median of {args.runs}), budget {args.budget_ms:.1f} ms")
+
+    print("slowest imports (self time):")
+    for name, self_us, _ in sorted(timings, key=lambda timing: -timing[1])[:args.top]:
+        print(f"  {self_us / 1000:8.2f} ms  {name}")
+
+    eager = sorted({name.split('.')[0] for name, _, _ in timings} & set(DEFERRED_MODULES))
+    failed = False
+    if eager:
+        print(f"FAIL: eagerly imported {', '.join(eager)}")
+        failed = True
+    if median_us / 1000 > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Micro-benchmark: line_diff against difflib.unified_diff on synthetic
+# CloudFormation templates.
+#
+#   python bench_line_diff.py [--sizes 10000,50000,100000] [--churn 0.01]
+#
+# difflib is the slow column by design: at 100k lines it can take minutes.
+import argparse
+import difflib
+import random
+import time
+
+from line_diff import line_changes
+
+
+def synthetic_template(line_count, seed=0):
+    rng = random.Random(seed)
+    lines = ["AWSTemplateFormatVersion: '2010-09-09'", "Resources:"]
+    index = 0
+    while len(lines) < line_count:
+        index += 1
+        lines.extend([
+            f"  Function{index}:",
+            "    Type: AWS::Lambda::Function",
+            "    Properties:",
+            f"      FunctionName: function{index}",
+            f"      Handler: handler{rng.randint(0, 50)}.lambda_handler",
+            "      Runtime: python3.11",
+            f"      MemorySize: {rng.choice([128, 256, 512])}",
+            f"      CodeUri: src/function{index}/",
+        ])
+    return lines[:line_count]
+
+def mutate(lines, churn, seed=1):
+    rng = random.Random(seed)
+    mutated = list(lines)
+    for _ in range(max(1, int(len(lines) * churn))):
+        position = rng.randrange(len(mutated))
+        if rng.random() < 0.5:
+            mutated[position] = f"      FunctionName: renamed{rng.randint(0, 10 ** 6)}"
+        else:
+            mutated.insert(position, f"      Description: added{rng.randint(0, 10 ** 6)}")
+    return mutated
+
+def run_difflib(before, after):
+    added = []
+    removed = []
+    for line in difflib.unified_diff(before, after, lineterm=''):
+        if line.startswith('+') and not line.startswith('+++'):
+            added.append(line[1:])
+        elif line.startswith('-') and not line.startswith('---'):
+            removed.append(line[1:])
+    return added, removed
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,50000,100000')
+    parser.add_argument('--churn', type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{'lines':>8} {'difflib':>10} {'multiset':>10} {'myers':>10}")
+    for size in (int(value) for value in args.sizes.split(',')):
+        before = synthetic_template(size)
+        after = mutate(before, args.churn)
+        difflib_time = timed(run_difflib, before, after)
+        multiset_time = timed(line_changes, before, after)
+        myers_time = timed(line_changes, before, after, True)
+        print(f"{size:>8} {difflib_time:>9.3f}s {multiset_time:>9.3f}s {myers_time:>9.3f}s")
+
+if __name__ == "__main__":
+    main()
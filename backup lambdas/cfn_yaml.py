@@ -0,0 +1,210 @@
+# YAML loader that understands CloudFormation short-form intrinsics.
+#
+# Tags such as !Ref or !GetAtt are expanded to their long JSON form
+# ({'Ref': ...}, {'Fn::GetAtt': [...]}) instead of being stripped from the
+# text beforehand. LibYAML's CSafeLoader is used when PyYAML was built with
+# it, falling back to the pure-Python SafeLoader otherwise.
+import yaml
+
+try:
+    from yaml import CSafeLoader as _BaseLoader
+except ImportError:
+    from yaml import SafeLoader as _BaseLoader
+
+
+# Short-form tags that map to a plain key rather than Fn::<Tag>
+PLAIN_INTRINSICS = ('Ref', 'Condition')
+
+FN_INTRINSICS = (
+    'And', 'Base64', 'Cidr', 'Equals', 'FindInMap', 'GetAZs', 'GetAtt',
+    'If', 'ImportValue', 'Join', 'Length', 'Not', 'Or', 'Select', 'Split',
+    'Sub', 'ToJsonString', 'Transform',
+)
+
+
+class CloudFormationLoader(_BaseLoader):
+    pass
+
+
+def _construct_node(loader, node):
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_mapping(node, deep=True)
+
+def _intrinsic_constructor(key):
+    def construct(loader, node):
+        return {key: _construct_node(loader, node)}
+    return construct
+
+def _construct_get_att(loader, node):
+    value = _construct_node(loader, node)
+    # !GetAtt Resource.Attribute is shorthand for [Resource, Attribute]
+    if isinstance(value, str):
+        value = value.split('.', 1)
+    return {'Fn::GetAtt': value}
+
+
+for _tag in PLAIN_INTRINSICS:
+    CloudFormationLoader.add_constructor(f'!{_tag}', _intrinsic_constructor(_tag))
+
+for _tag in FN_INTRINSICS:
+    CloudFormationLoader.add_constructor(f'!{_tag}', _intrinsic_constructor(f'Fn::{_tag}'))
+
+CloudFormationLoader.add_constructor('!GetAtt', _construct_get_att)
+
+
+def load_template(template_text):
+    return yaml.load(template_text, Loader=CloudFormationLoader)
+
+
+# Only these properties of a resource are indexed
+INDEXED_PROPERTIES = ('Handler', 'FunctionName')
+
+_STR_TAG = 'tag:yaml.org,2002:str'
+
+_resolver = yaml.resolver.Resolver()
+
+
+class _FullParseRequired(Exception):
+    # Merge keys and aliases of whole mappings need the constructor to resolve
+    pass
+
+
+def _literal(event, anchors):
+    # Returns the string a scalar stands for, or None for anything handler_functions would skip
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise _FullParseRequired(event.anchor)
+        return anchors[event.anchor]
+    if not isinstance(event, yaml.ScalarEvent):
+        return None
+    if event.tag is None:
+        # Plain scalars such as 123 or true resolve to other types
+        return event.value if _resolver.resolve(yaml.ScalarNode, event.value, event.implicit) == _STR_TAG else None
+    # '!' is the non-specific tag of quoted scalars; !Sub and friends are intrinsics
+    return event.value if event.tag in ('!', _STR_TAG) else None
+
+def _skip(events, event, anchors):
+    # Consumes the node that starts with event, remembering scalar anchors an alias may refer to later
+    depth = 0
+    while True:
+        if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+            depth += 1
+        elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+            depth -= 1
+        elif isinstance(event, yaml.ScalarEvent) and event.anchor:
+            anchors[event.anchor] = _literal(event, anchors)
+        if depth == 0:
+            return
+        event = next(events)
+
+def _mapping_items(events, anchors):
+    # Yields (key, first event of the value) of the mapping whose start was just consumed;
+    # the caller must consume each value before asking for the next pair
+    while True:
+        event = next(events)
+        if isinstance(event, yaml.MappingEndEvent):
+            return
+        if isinstance(event, yaml.ScalarEvent):
+            if event.value == '<<' and event.tag is None:
+                raise _FullParseRequired('<<')
+            if event.anchor:
+                anchors[event.anchor] = _literal(event, anchors)
+            key = event.value
+        else:
+            # Complex and aliased keys never name a section this module reads
+            _skip(events, event, anchors)
+            key = None
+        yield key, next(events)
+
+def _mapping_value(events, event, anchors):
+    # Returns True when event starts a mapping to descend into; other values are consumed
+    if isinstance(event, yaml.MappingStartEvent):
+        return True
+    if isinstance(event, yaml.AliasEvent):
+        raise _FullParseRequired(event.anchor)
+    _skip(events, event, anchors)
+    return False
+
+def _indexed_properties(events, anchors):
+    properties = {}
+    for key, event in _mapping_items(events, anchors):
+        if key in INDEXED_PROPERTIES:
+            properties[key] = _literal(event, anchors)
+        _skip(events, event, anchors)
+    return properties
+
+def _handler_resources(events, anchors):
+    resources = {}
+    for logical_id, event in _mapping_items(events, anchors):
+        if not _mapping_value(events, event, anchors):
+            continue
+        properties = None
+        for key, property_event in _mapping_items(events, anchors):
+            if key == 'Properties' and _mapping_value(events, property_event, anchors):
+                properties = _indexed_properties(events, anchors)
+            elif key != 'Properties':
+                _skip(events, property_event, anchors)
+        if properties is not None and 'Handler' in properties:
+            resources[logical_id] = {'Properties': properties}
+        else:
+            resources.pop(logical_id, None)
+    return resources
+
+def _stream_handler_resources(template_text):
+    events = yaml.parse(template_text, Loader=CloudFormationLoader)
+    anchors = {}
+    resources = {}
+
+    next(events)  # StreamStartEvent
+    event = next(events)
+    if isinstance(event, yaml.StreamEndEvent):
+        # An empty document; the full parse reports it the same way as any unusable template
+        raise _FullParseRequired('empty document')
+    event = next(events)  # the root node
+    if not isinstance(event, yaml.MappingStartEvent):
+        raise _FullParseRequired('root is not a mapping')
+
+    for key, event in _mapping_items(events, anchors):
+        if key != 'Resources':
+            _skip(events, event, anchors)
+        elif isinstance(event, yaml.MappingStartEvent):
+            # A repeated key wins, as in the full parse
+            resources = _handler_resources(events, anchors)
+        else:
+            raise _FullParseRequired('Resources is not a mapping')
+
+    next(events)  # DocumentEndEvent
+    if not isinstance(next(events), yaml.StreamEndEvent):
+        raise _FullParseRequired('more than one document')
+    return resources
+
+def handler_resources(resources):
+    # Trims a full Resources map down to what load_handler_resources returns; values that are
+    # not strings (numbers, intrinsics) become None, as the event stream reports them
+    if not isinstance(resources, dict):
+        return resources
+    trimmed = {}
+    for logical_id, resource in resources.items():
+        properties = resource.get('Properties') if isinstance(resource, dict) else None
+        if isinstance(properties, dict) and 'Handler' in properties:
+            trimmed[logical_id] = {
+                'Properties': {
+                    key: properties[key] if isinstance(properties[key], str) else None
+                    for key in INDEXED_PROPERTIES if key in properties
+                }
+            }
+    return trimmed
+
+def load_handler_resources(template_text):
+    # Returns the Resources map reduced to resources with a Handler and their Handler and
+    # FunctionName, read from the parser's event stream without building the document.
+    # Memory stays proportional to the nesting depth and the functions found, not the
+    # template size. Templates the events cannot answer for alone (merge keys, aliased
+    # mappings, odd layouts) go through load_template, so both paths agree.
+    try:
+        return _stream_handler_resources(template_text)
+    except _FullParseRequired:
+        return handler_resources(load_template(template_text).get('Resources', {}))
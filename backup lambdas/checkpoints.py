@@ -0,0 +1,131 @@
+# Last processed commit per repository branch.
+#
+# The handler diffs from the checkpoint to the pushed head instead of from the
+# head's first parent, so multi-commit pushes are covered in full and retried
+# or duplicated deliveries are skipped, as are late pushes whose head is an
+# ancestor of the checkpoint. A branch is claimed with a conditional
+# lease before its index updates are applied, so two concurrent invocations
+# cannot apply the same range; a crashed claim expires after the lease. A push
+# that finds its branch claimed waits for the lease and fails if it outlasts
+# CHECKPOINT_CLAIM_WAIT, so the invocation is retried instead of dropping it.
+#
+#   python checkpoints.py create
+import os
+import sys
+import time
+
+from aws_clients import LazyClient
+
+CHECKPOINT_TABLE_NAME = os.environ.get('CHECKPOINT_TABLE_NAME', 'commit_checkpoints')
+
+# Should outlast the Lambda timeout
+CHECKPOINT_LEASE_SECONDS = int(os.environ.get('CHECKPOINT_LEASE_SECONDS', '900'))
+
+# How long a push waits for another invocation's lease on its branch before failing
+CHECKPOINT_CLAIM_WAIT = float(os.environ.get('CHECKPOINT_CLAIM_WAIT', '60'))
+
+# Heads remembered per branch so late duplicates of older pushes are recognised
+RECENT_COMMITS = 50
+
+dynamodb = LazyClient('dynamodb')
+
+
+class CheckpointBusy(Exception):
+    pass
+
+
+def create_checkpoint_table():
+    dynamodb.create_table(
+        TableName=CHECKPOINT_TABLE_NAME,
+        KeySchema=[{'AttributeName': 'branch_key', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'branch_key', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=CHECKPOINT_TABLE_NAME)
+
+def checkpoint_key(repository, branch_name):
+    return {'branch_key': {'S': f"{repository}#{branch_name}"}}
+
+def read_checkpoint(repository, branch_name):
+    # Returns None when the checkpoint table does not exist, which disables checkpointing
+    try:
+        response = dynamodb.get_item(
+            TableName=CHECKPOINT_TABLE_NAME,
+            Key=checkpoint_key(repository, branch_name),
+            ConsistentRead=True
+        )
+    except dynamodb.exceptions.ResourceNotFoundException:
+        print(f"Checkpoint table {CHECKPOINT_TABLE_NAME} not found, processing without checkpoints")
+        return None
+
+    item = response.get('Item', {})
+    return {
+        'commit_id': item.get('commit_id', {}).get('S'),
+        'pending_commit_id': item.get('pending_commit_id', {}).get('S'),
+        'lease_expires': float(item.get('lease_expires', {}).get('N', '0')),
+        'recent_commits': [value['S'] for value in item.get('recent_commits', {}).get('L', [])]
+    }
+
+def is_processed(checkpoint, commit_id):
+    return commit_id == checkpoint['commit_id'] or commit_id in checkpoint['recent_commits']
+
+def claim_checkpoint(repository, branch_name, head_commit_id, checkpoint):
+    now = time.time()
+    if checkpoint['pending_commit_id'] and checkpoint['lease_expires'] > now:
+        return False
+
+    values = {
+        ':head': {'S': head_commit_id},
+        ':now': {'N': str(now)},
+        ':expires': {'N': str(now + CHECKPOINT_LEASE_SECONDS)}
+    }
+    # The checkpoint must not have moved since it was read, and no live lease may exist
+    if checkpoint['commit_id']:
+        seen_condition = 'commit_id = :seen'
+        values[':seen'] = {'S': checkpoint['commit_id']}
+    else:
+        seen_condition = 'attribute_not_exists(commit_id)'
+
+    try:
+        dynamodb.update_item(
+            TableName=CHECKPOINT_TABLE_NAME,
+            Key=checkpoint_key(repository, branch_name),
+            UpdateExpression='SET pending_commit_id = :head, lease_expires = :expires',
+            ConditionExpression=f'{seen_condition} AND (attribute_not_exists(lease_expires) OR lease_expires < :now)',
+            ExpressionAttributeValues=values
+        )
+        return True
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+
+def complete_checkpoint(repository, branch_name, head_commit_id, checkpoint, commit_ids=()):
+    # commit_ids are the heads of every push the applied range covered, in push order
+    recent_commits = list(dict.fromkeys([head_commit_id, *reversed(commit_ids), *checkpoint['recent_commits']]))
+    dynamodb.update_item(
+        TableName=CHECKPOINT_TABLE_NAME,
+        Key=checkpoint_key(repository, branch_name),
+        UpdateExpression='SET commit_id = :head, recent_commits = :recent REMOVE pending_commit_id, lease_expires',
+        ConditionExpression='pending_commit_id = :head',
+        ExpressionAttributeValues={
+            ':head': {'S': head_commit_id},
+            ':recent': {'L': [{'S': commit_id} for commit_id in recent_commits[:RECENT_COMMITS]]}
+        }
+    )
+
+def release_checkpoint(repository, branch_name, head_commit_id):
+    try:
+        dynamodb.update_item(
+            TableName=CHECKPOINT_TABLE_NAME,
+            Key=checkpoint_key(repository, branch_name),
+            UpdateExpression='REMOVE pending_commit_id, lease_expires',
+            ConditionExpression='pending_commit_id = :head',
+            ExpressionAttributeValues={':head': {'S': head_commit_id}}
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['create']:
+        create_checkpoint_table()
+    else:
+        print("usage: python checkpoints.py create")
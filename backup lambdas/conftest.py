@@ -0,0 +1,46 @@
+# Fixtures shared by the tests: the in-memory fakes of fake_aws in place of AWS.
+import pytest
+
+import automatedscript_ostrum
+import checkpoints
+import fake_aws
+import function_index
+import handler_tables
+import repository_sources
+import template_cache
+from bench_handler import index_state
+
+
+def template(*functions):
+    # functions are (function_name, handler) pairs
+    lines = ['Resources:']
+    for function_name, handler in functions:
+        lines += [
+            f'  {function_name.title()}:',
+            '    Type: AWS::Serverless::Function',
+            '    Properties:',
+            f'      Handler: {handler}',
+            f'      FunctionName: {function_name}',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def indexed(dynamodb):
+    # Returns the (table_name, function_name) pairs indexed, which the handler tables must match
+    stored, index = index_state(dynamodb)
+    assert stored == index
+    return stored
+
+
+@pytest.fixture
+def fakes(monkeypatch, tmp_path):
+    monkeypatch.setattr(template_cache, 'TEMPLATE_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(repository_sources, 'REPOSITORY_SOURCE', 'codecommit')
+    monkeypatch.setattr(automatedscript_ostrum, 'PIPELINE_ENGINE', 'sync')
+    codecommit, dynamodb = fake_aws.install_fakes()
+    handler_tables._active_tables.clear()
+    template_cache.clear_cache()
+    repository_sources._sources.clear()
+    function_index.create_index_table()
+    checkpoints.create_checkpoint_table()
+    return codecommit, dynamodb
@@ -1,100 +1,25 @@
-import boto3
-
-# Initialize the AWS CodeCommit client
-client = boto3.client('codecommit')
-
-def remove_function(table_name, partition_key_value, value_to_remove):
-    
-    # Initialize the DynamoDB client
-    dynamodb = boto3.client('dynamodb')
-    
-    # Value to remove from the comma-separated string
-    # value_to_remove = 'listBugs'
-    
-    # Attribute name to update
-    attribute_name = 'function_name'
-    
-    try:
-        # Construct the primary key
-        primary_key = {'file_name': {'S': partition_key_value}}
-        
-        # Retrieve the item from DynamoDB
-        response = dynamodb.get_item(TableName=table_name, Key=primary_key)
-        
-        # Check if the item exists
-        if 'Item' in response:
-            item = response['Item']
-            
-            # Extract the comma-separated string from the item
-            if attribute_name in item:
-                comma_separated_string = item[attribute_name]['S']
-                
-                # Split the string into a list
-                values_list = comma_separated_string.split(',')
-                
-                # Remove the value you want to delete
-                if value_to_remove in values_list:
-                    values_list.remove(value_to_remove)
-                    
-                    # Join the list back into a string
-                    updated_string = ','.join(values_list)
-                    
-                    # Update the item in DynamoDB with the modified string
-                    dynamodb.update_item(
-                        TableName=table_name,
-                        Key=primary_key,
-                        UpdateExpression=f'SET {attribute_name} = :updated_string',
-                        ExpressionAttributeValues={':updated_string': {'S': updated_string}}
-                    )
-                    print(f"Removed '{value_to_remove}' from '{attribute_name}' in table {table_name}")
-                else:
-                    print(f"'{value_to_remove}' not found in '{attribute_name}' in table {table_name}")
-            else:
-                print(f"'{attribute_name}' not found in item in table {table_name}")
-        else:
-            print(f"Item not found in table {table_name}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
+from function_index import bump_index_version, lookup_function, unregister_function
+from handler_tables import remove_function
 
 def lambda_handler(event, context):
-    # Initialize the DynamoDB client
-    dynamodb = boto3.client('dynamodb')
-    
-    # List all DynamoDB tables
-    table_names = dynamodb.list_tables()['TableNames']
-    
     # Value to search for
     search_value = 'listBugs'
-    
-    # Attribute names to search in
-    function_name_attribute_name = 'function_name'
-    file_name_attribute_name = 'file_name'
-    
-    # Iterate through each table and perform a scan
-    for table_name in table_names:
+
+    # The reverse index holds exact function names, so 'listBugs' no longer matches 'listBugsV2'
+    locations = lookup_function(search_value)
+    if not locations:
+        print(f"No indexed handler table lists function {search_value}")
+
+    for table_name, file_name_value in locations:
         try:
-            response = dynamodb.scan(
-                TableName=table_name,
-                FilterExpression='contains(#func_attr, :value)',
-                ExpressionAttributeNames={'#func_attr': function_name_attribute_name},
-                ExpressionAttributeValues={':value': {'S': search_value}}
-            )
-            
-            # Check if any items match the search in the current table
-            if 'Items' in response and len(response['Items']) > 0:
-                print(f"Found matching items in table {table_name}:")
-                for item in response['Items']:
-                    # Check if the file_name attribute exists in the item
-                    if file_name_attribute_name in item:
-                        file_name_value = item[file_name_attribute_name]['S']
-                        print(f"File Name: {file_name_value}")
-                        remove_function(table_name, file_name_value, search_value)
-                    print("Item:", item)
-            else:
-                print(f"No matching items found in table {table_name}")
+            print(f"File Name: {file_name_value}")
+            remove_function(table_name, file_name_value, search_value)
+            unregister_function(search_value, table_name)
         except Exception as e:
-            print(f"An error occurred while scanning table {table_name}: {e}")
+            print(f"An error occurred while updating table {table_name}: {e}")
+
+    if locations:
+        bump_index_version()
 
 # import boto3
 # import botocore
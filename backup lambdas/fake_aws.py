@@ -0,0 +1,591 @@
+# In-process stand-ins for the CodeCommit and DynamoDB clients.
+#
+# They implement only the operations and expression forms the lambdas use,
+# count every call per operation, and can add a fixed per-call latency to
+# model the network. install_fakes() puts them into the aws_clients registry
+# so every LazyClient in the lambdas resolves to them; boto3 is never
+# imported. Used by bench_handler.py.
+import copy
+import hashlib
+import re
+import threading
+import time
+from collections import Counter
+
+
+# Error code -> the reason DynamoDB reports for that item of a cancelled transaction
+CANCELLATION_REASONS = {
+    'ConditionalCheckFailedException': 'ConditionalCheckFailed',
+    'ValidationException': 'ValidationError',
+    'ProvisionedThroughputExceededException': 'ProvisionedThroughputExceeded',
+    'ThrottlingException': 'ThrottlingError',
+}
+
+
+class FakeClientError(Exception):
+    code = 'ClientError'
+
+    def __init__(self, message='', operation_name=''):
+        super().__init__(f"An error occurred ({self.code}) when calling the {operation_name} operation: {message}")
+        self.response = {'Error': {'Code': self.code, 'Message': message}}
+        self.operation_name = operation_name
+
+
+def _error_class(code):
+    return type(code, (FakeClientError,), {'code': code})
+
+
+class _Exceptions:
+    ClientError = FakeClientError
+
+    def __init__(self, codes):
+        for code in codes:
+            setattr(self, code, _error_class(code))
+
+
+class _FakeClient:
+    service_name = None
+    error_codes = ()
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.exceptions = _Exceptions(self.error_codes)
+        self._lock = threading.RLock()
+
+    def _call(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _error(self, code, message, operation_name):
+        return getattr(self.exceptions, code)(message, operation_name)
+
+
+# ---------------------------------------------------------------- CodeCommit
+
+def blob_id_for(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+class FakeCodeCommit(_FakeClient):
+    service_name = 'codecommit'
+    error_codes = ('FileDoesNotExistException', 'CommitDoesNotExistException', 'BlobIdDoesNotExistException')
+
+    # get_differences returns at most this many entries per page, like CodeCommit
+    page_size = 100
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.blobs = {}
+        # commit_id -> {'parents': [...], 'files': {path: blob_id}}
+        self.commits = {}
+
+    def add_commit(self, commit_id, files, parent=None):
+        tree = {}
+        for path, content in files.items():
+            content = content.encode('utf-8') if isinstance(content, str) else content
+            blob_id = blob_id_for(content)
+            self.blobs[blob_id] = content
+            tree[path] = blob_id
+        self.commits[commit_id] = {'parents': [parent] if parent else [], 'files': tree}
+        return commit_id
+
+    def _tree(self, commit_id, operation_name):
+        if commit_id not in self.commits:
+            raise self._error('CommitDoesNotExistException', commit_id, operation_name)
+        return self.commits[commit_id]['files']
+
+    def get_commit(self, repositoryName, commitId):
+        self._call('GetCommit')
+        self._tree(commitId, 'GetCommit')
+        return {'commit': {'commitId': commitId, 'parents': list(self.commits[commitId]['parents'])}}
+
+    def get_merge_commit(self, repositoryName, sourceCommitSpecifier, destinationCommitSpecifier, **kwargs):
+        # Only the merge base is computed; nothing here ever merges
+        self._call('GetMergeCommit')
+        self._tree(sourceCommitSpecifier, 'GetMergeCommit')
+        ancestors = set()
+        pending = [sourceCommitSpecifier]
+        while pending:
+            commit_id = pending.pop()
+            if commit_id not in ancestors:
+                ancestors.add(commit_id)
+                pending.extend(self.commits[commit_id]['parents'] if commit_id in self.commits else [])
+        # Breadth-first from the destination, so the nearest common ancestor is found first
+        queue = [destinationCommitSpecifier]
+        for commit_id in queue:
+            if commit_id in ancestors:
+                return {
+                    'sourceCommitId': sourceCommitSpecifier,
+                    'destinationCommitId': destinationCommitSpecifier,
+                    'baseCommitId': commit_id
+                }
+            self._tree(commit_id, 'GetMergeCommit')
+            queue.extend(self.commits[commit_id]['parents'])
+        raise self._error('CommitDoesNotExistException', 'no common ancestor', 'GetMergeCommit')
+
+    def get_blob(self, repositoryName, blobId):
+        self._call('GetBlob')
+        if blobId not in self.blobs:
+            raise self._error('BlobIdDoesNotExistException', blobId, 'GetBlob')
+        return {'content': self.blobs[blobId]}
+
+    def get_file(self, repositoryName, commitSpecifier, filePath):
+        self._call('GetFile')
+        tree = self._tree(commitSpecifier, 'GetFile')
+        if filePath not in tree:
+            raise self._error('FileDoesNotExistException', filePath, 'GetFile')
+        blob_id = tree[filePath]
+        return {'blobId': blob_id, 'filePath': filePath, 'fileContent': self.blobs[blob_id]}
+
+    def get_differences(self, repositoryName, afterCommitSpecifier, beforeCommitSpecifier=None, NextToken=None, **kwargs):
+        self._call('GetDifferences')
+        after = self._tree(afterCommitSpecifier, 'GetDifferences')
+        before = self._tree(beforeCommitSpecifier, 'GetDifferences') if beforeCommitSpecifier else {}
+
+        differences = []
+        for path in sorted(before.keys() | after.keys()):
+            before_blob, after_blob = before.get(path), after.get(path)
+            if before_blob == after_blob:
+                continue
+            difference = {'changeType': 'M' if before_blob and after_blob else ('A' if after_blob else 'D')}
+            if before_blob:
+                difference['beforeBlob'] = {'blobId': before_blob, 'path': path, 'mode': '100644'}
+            if after_blob:
+                difference['afterBlob'] = {'blobId': after_blob, 'path': path, 'mode': '100644'}
+            differences.append(difference)
+
+        start = int(NextToken or 0)
+        response = {'differences': differences[start:start + self.page_size]}
+        if start + self.page_size < len(differences):
+            response['NextToken'] = str(start + self.page_size)
+        return response
+
+
+# ------------------------------------------------------- DynamoDB expressions
+
+_TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),]|[#:]?[A-Za-z_][\w.\-]*)')
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match:
+            raise ValueError(f"Cannot parse expression at: {expression[position:]}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+def _split_top_level(text, separator=','):
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _plain(value):
+    # Comparable Python value for a typed attribute value
+    if value is None:
+        return None
+    (kind, inner), = value.items()
+    if kind == 'N':
+        return float(inner)
+    if kind in ('SS', 'NS', 'BS'):
+        return frozenset(inner)
+    if kind == 'L':
+        return tuple(_plain(element) for element in inner)
+    return inner
+
+
+class _Expression:
+    def __init__(self, kwargs):
+        self.names = kwargs.get('ExpressionAttributeNames', {})
+        self.values = kwargs.get('ExpressionAttributeValues', {})
+
+    def name(self, token):
+        return self.names[token] if token.startswith('#') else token
+
+    def operand(self, token, item):
+        if token.startswith(':'):
+            return self.values[token]
+        return item.get(self.name(token))
+
+    # Conditions: OR > AND > NOT > comparison/function
+    def evaluate(self, expression, item):
+        if not expression:
+            return True
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        result = self._or(item)
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected token {self.tokens[self.position]} in {expression}")
+        return result
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _or(self, item):
+        result = self._and(item)
+        while self._peek() and self._peek().upper() == 'OR':
+            self._next()
+            right = self._and(item)
+            result = result or right
+        return result
+
+    def _and(self, item):
+        result = self._not(item)
+        while self._peek() and self._peek().upper() == 'AND':
+            self._next()
+            right = self._not(item)
+            result = result and right
+        return result
+
+    def _not(self, item):
+        if self._peek() and self._peek().upper() == 'NOT':
+            self._next()
+            return not self._not(item)
+        return self._comparison(item)
+
+    def _comparison(self, item):
+        token = self._next()
+        if token == '(':
+            result = self._or(item)
+            self._next()
+            return result
+
+        if self._peek() == '(':
+            self._next()
+            arguments = []
+            while self._peek() != ')':
+                argument = self._next()
+                if argument != ',':
+                    arguments.append(argument)
+            self._next()
+            return self._function(token, arguments, item)
+
+        operator = self._next()
+        left = _plain(self.operand(token, item))
+        right = _plain(self.operand(self._next(), item))
+        if operator == '=':
+            return left == right
+        if operator == '<>':
+            return left != right
+        if left is None or right is None:
+            return False
+        return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+
+    def _function(self, function_name, arguments, item):
+        attribute = item.get(self.name(arguments[0]))
+        if function_name == 'attribute_exists':
+            return attribute is not None
+        if function_name == 'attribute_not_exists':
+            return attribute is None
+        if function_name == 'attribute_type':
+            return attribute is not None and next(iter(attribute)) == _plain(self.values[arguments[1]])
+        if function_name == 'contains':
+            needle = _plain(self.operand(arguments[1], item))
+            haystack = _plain(attribute)
+            return haystack is not None and needle in haystack
+        if function_name == 'begins_with':
+            haystack = _plain(attribute)
+            return isinstance(haystack, str) and haystack.startswith(_plain(self.operand(arguments[1], item)))
+        raise ValueError(f"Unsupported function {function_name}")
+
+    def apply_update(self, expression, item):
+        clauses = re.split(r'\b(SET|ADD|DELETE|REMOVE)\b', expression, flags=re.IGNORECASE)
+        for keyword, body in zip(clauses[1::2], clauses[2::2]):
+            keyword = keyword.upper()
+            for action in _split_top_level(body):
+                if keyword == 'SET':
+                    path, value = (part.strip() for part in action.split('=', 1))
+                    item[self.name(path)] = self._set_value(value, item)
+                elif keyword == 'REMOVE':
+                    item.pop(self.name(action), None)
+                else:
+                    path, value = action.split()
+                    self._set_operation(keyword, self.name(path), self.values[value], item)
+
+    def _set_value(self, value, item):
+        match = re.match(r'if_not_exists\(\s*([#\w]+)\s*,\s*(:\w+)\s*\)', value)
+        if match:
+            existing = item.get(self.name(match.group(1)))
+            return existing if existing is not None else self.values[match.group(2)]
+        return copy.deepcopy(self.operand(value, item))
+
+    def _set_operation(self, keyword, name, value, item):
+        (kind, inner), = value.items()
+        existing = item.get(name)
+        if existing is not None and kind not in existing:
+            raise TypeError(f"An operand in the update expression has an incorrect data type for {name}")
+
+        if kind == 'N':
+            current = float(existing['N']) if existing else 0
+            total = current + float(inner)
+            item[name] = {'N': str(int(total) if total.is_integer() else total)}
+            return
+
+        members = set(existing[kind]) if existing else set()
+        members = members | set(inner) if keyword == 'ADD' else members - set(inner)
+        if members:
+            item[name] = {kind: sorted(members)}
+        else:
+            item.pop(name, None)
+
+
+# ------------------------------------------------------------------- DynamoDB
+
+class _Paginator:
+    def __init__(self, method, result_key, page_size=100):
+        self.method = method
+        self.result_key = result_key
+        self.page_size = page_size
+
+    def paginate(self, **kwargs):
+        results = self.method(**kwargs)[self.result_key]
+        for start in range(0, max(len(results), 1), self.page_size):
+            yield {self.result_key: results[start:start + self.page_size]}
+
+
+class _Waiter:
+    def wait(self, **kwargs):
+        pass
+
+
+class FakeDynamoDB(_FakeClient):
+    service_name = 'dynamodb'
+    error_codes = (
+        'ResourceNotFoundException', 'ResourceInUseException', 'ConditionalCheckFailedException',
+        'TransactionCanceledException', 'ValidationException', 'ProvisionedThroughputExceededException',
+    )
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        # table_name -> {'key_names': [...], 'items': {key: item}, 'description': {...}}
+        self.tables = {}
+
+    # Tables
+    def create_table(self, TableName, KeySchema, AttributeDefinitions, **kwargs):
+        self._call('CreateTable')
+        with self._lock:
+            if TableName in self.tables:
+                raise self._error('ResourceInUseException', TableName, 'CreateTable')
+            throughput = kwargs.get('ProvisionedThroughput', {'ReadCapacityUnits': 0, 'WriteCapacityUnits': 0})
+            self.tables[TableName] = {
+                'key_names': [key['AttributeName'] for key in KeySchema],
+                'items': {},
+                'description': {
+                    'TableName': TableName,
+                    'TableStatus': 'ACTIVE',
+                    'KeySchema': KeySchema,
+                    'AttributeDefinitions': AttributeDefinitions,
+                    'ProvisionedThroughput': throughput,
+                    'BillingModeSummary': {'BillingMode': kwargs.get('BillingMode', 'PROVISIONED')}
+                }
+            }
+        return {'TableDescription': self.tables[TableName]['description']}
+
+    def describe_table(self, TableName):
+        self._call('DescribeTable')
+        return {'Table': self._table(TableName, 'DescribeTable')['description']}
+
+    def list_tables(self, **kwargs):
+        self._call('ListTables')
+        return {'TableNames': sorted(self.tables)}
+
+    def get_paginator(self, operation_name):
+        methods = {'list_tables': (self.list_tables, 'TableNames'), 'scan': (self.scan, 'Items'), 'query': (self.query, 'Items')}
+        return _Paginator(*methods[operation_name])
+
+    def get_waiter(self, waiter_name):
+        return _Waiter()
+
+    def _table(self, table_name, operation_name):
+        if table_name not in self.tables:
+            raise self._error('ResourceNotFoundException', f"Requested resource not found: {table_name}", operation_name)
+        return self.tables[table_name]
+
+    def _key(self, table, key):
+        return tuple(_plain(key[name]) for name in table['key_names'])
+
+    def _consumed(self, kwargs, table_name, units=1.0):
+        if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+            return {'ConsumedCapacity': {'TableName': table_name, 'CapacityUnits': units}}
+        return {}
+
+    # Items
+    def get_item(self, TableName, Key, **kwargs):
+        self._call('GetItem')
+        with self._lock:
+            table = self._table(TableName, 'GetItem')
+            item = table['items'].get(self._key(table, Key))
+            response = self._consumed(kwargs, TableName, 0.5)
+            if item is not None:
+                response['Item'] = copy.deepcopy(item)
+            return response
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._call('PutItem')
+        with self._lock:
+            table = self._table(TableName, 'PutItem')
+            key = self._key(table, Item)
+            self._check(kwargs, table['items'].get(key, {}), 'PutItem')
+            table['items'][key] = copy.deepcopy(Item)
+            return self._consumed(kwargs, TableName)
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self._call('DeleteItem')
+        with self._lock:
+            table = self._table(TableName, 'DeleteItem')
+            key = self._key(table, Key)
+            self._check(kwargs, table['items'].get(key, {}), 'DeleteItem')
+            table['items'].pop(key, None)
+            return self._consumed(kwargs, TableName)
+
+    def update_item(self, TableName, Key, UpdateExpression, **kwargs):
+        self._call('UpdateItem')
+        with self._lock:
+            before, after = self._update(TableName, Key, UpdateExpression, kwargs, 'UpdateItem')
+            response = self._consumed(kwargs, TableName)
+            return_values = kwargs.get('ReturnValues', 'NONE')
+            if return_values == 'ALL_NEW':
+                response['Attributes'] = copy.deepcopy(after)
+            elif return_values == 'UPDATED_NEW':
+                response['Attributes'] = {
+                    name: copy.deepcopy(value) for name, value in after.items() if before.get(name) != value
+                }
+            return response
+
+    def _check(self, kwargs, item, operation_name):
+        if not _Expression(kwargs).evaluate(kwargs.get('ConditionExpression'), item):
+            raise self._error('ConditionalCheckFailedException', 'The conditional request failed', operation_name)
+
+    def _update(self, table_name, key, update_expression, kwargs, operation_name):
+        table = self._table(table_name, operation_name)
+        item_key = self._key(table, key)
+        before = table['items'].get(item_key, {})
+        item = copy.deepcopy(before)
+        self._check(kwargs, item, operation_name)
+        item.update(copy.deepcopy(key))
+        try:
+            _Expression(kwargs).apply_update(update_expression, item)
+        except TypeError as e:
+            raise self._error('ValidationException', str(e), operation_name)
+        table['items'][item_key] = item
+        return before, item
+
+    def query(self, TableName, KeyConditionExpression, **kwargs):
+        self._call('Query')
+        with self._lock:
+            table = self._table(TableName, 'Query')
+            expression = _Expression(kwargs)
+            items = [
+                copy.deepcopy(item) for item in table['items'].values()
+                if expression.evaluate(KeyConditionExpression, item)
+                and expression.evaluate(kwargs.get('FilterExpression'), item)
+            ]
+            return {'Items': items, 'Count': len(items), **self._consumed(kwargs, TableName, 0.5 * max(len(items), 1))}
+
+    def scan(self, TableName, **kwargs):
+        self._call('Scan')
+        with self._lock:
+            table = self._table(TableName, 'Scan')
+            expression = _Expression(kwargs)
+            items = [
+                copy.deepcopy(item) for item in table['items'].values()
+                if expression.evaluate(kwargs.get('FilterExpression'), item)
+            ]
+            return {'Items': items, 'Count': len(items), **self._consumed(kwargs, TableName, 0.5 * max(len(table['items']), 1))}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self._call('BatchGetItem')
+        responses = {}
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise self._error('ValidationException', 'Too many items requested for the BatchGetItem call', 'BatchGetItem')
+        with self._lock:
+            for table_name, request in RequestItems.items():
+                table = self._table(table_name, 'BatchGetItem')
+                responses[table_name] = [
+                    copy.deepcopy(table['items'][self._key(table, key)])
+                    for key in request['Keys'] if self._key(table, key) in table['items']
+                ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self._call('BatchWriteItem')
+        with self._lock:
+            for table_name, requests in RequestItems.items():
+                table = self._table(table_name, 'BatchWriteItem')
+                if len(requests) > 25:
+                    raise self._error('ValidationException', 'Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        table['items'][self._key(table, item)] = copy.deepcopy(item)
+                    else:
+                        table['items'].pop(self._key(table, request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': {}}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self._call('TransactWriteItems')
+        with self._lock:
+            snapshot = {name: dict(table['items']) for name, table in self.tables.items()}
+            try:
+                for position, action in enumerate(TransactItems):
+                    (kind, request), = action.items()
+                    if kind == 'Update':
+                        self._update(request['TableName'], request['Key'], request['UpdateExpression'], request, 'TransactWriteItems')
+                    elif kind == 'Put':
+                        table = self._table(request['TableName'], 'TransactWriteItems')
+                        key = self._key(table, request['Item'])
+                        self._check(request, table['items'].get(key, {}), 'TransactWriteItems')
+                        table['items'][key] = copy.deepcopy(request['Item'])
+                    elif kind == 'Delete':
+                        table = self._table(request['TableName'], 'TransactWriteItems')
+                        key = self._key(table, request['Key'])
+                        self._check(request, table['items'].get(key, {}), 'TransactWriteItems')
+                        table['items'].pop(key, None)
+                    else:
+                        table = self._table(request['TableName'], 'TransactWriteItems')
+                        self._check(request, table['items'].get(self._key(table, request['Key']), {}), 'TransactWriteItems')
+            except FakeClientError as e:
+                for name, items in snapshot.items():
+                    self.tables[name]['items'] = items
+                error = self._error('TransactionCanceledException', f"Transaction cancelled: {e.code}", 'TransactWriteItems')
+                error.response['CancellationReasons'] = [
+                    {'Code': CANCELLATION_REASONS.get(e.code, e.code) if index == position else 'None'}
+                    for index in range(len(TransactItems))
+                ]
+                raise error
+        return {}
+
+
+def install_fakes(codecommit=None, dynamodb=None, latency=0.0):
+    # Every LazyClient('codecommit') / LazyClient('dynamodb') resolves to these from now on
+    import aws_clients
+
+    codecommit = codecommit or FakeCodeCommit(latency)
+    dynamodb = dynamodb or FakeDynamoDB(latency)
+    aws_clients._clients[('codecommit', None)] = codecommit
+    aws_clients._clients[('dynamodb', None)] = dynamodb
+    return codecommit, dynamodb
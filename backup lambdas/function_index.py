@@ -0,0 +1,131 @@
+# Reverse index from function name to the handler table/file that lists it.
+#
+# One item per (function_name, table_name) pair lets a removal find its
+# handler tables with a single Query instead of scanning every table in the
+# account. Every writer bumps a version stamp stored in the same table, so
+# readers that cache lookups know when to drop them. Existing handler tables
+# can be indexed with:
+#
+#   python function_index.py backfill
+import sys
+import time
+
+from aws_clients import LazyClient
+from handler_tables import batch_write_table, list_handler_tables, read_function_names
+
+INDEX_TABLE_NAME = 'function_index'
+
+# Lambda function names cannot contain '#', so this key never collides with a function
+INDEX_VERSION_NAME = '#index_version'
+
+dynamodb = LazyClient('dynamodb')
+
+
+def create_index_table():
+    dynamodb.create_table(
+        TableName=INDEX_TABLE_NAME,
+        KeySchema=[
+            {'AttributeName': 'function_name', 'KeyType': 'HASH'},
+            {'AttributeName': 'table_name', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'function_name', 'AttributeType': 'S'},
+            {'AttributeName': 'table_name', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=INDEX_TABLE_NAME)
+
+def index_item(function_name, table_name, file_name, folder_name=None):
+    item = {
+        'function_name': {'S': function_name},
+        'table_name': {'S': table_name},
+        'file_name': {'S': file_name}
+    }
+    if folder_name:
+        # Name of the template the function was registered from
+        item['folder_name'] = {'S': folder_name}
+    return item
+
+def is_version_item(item):
+    return item['function_name']['S'] == INDEX_VERSION_NAME
+
+def unregister_function(function_name, table_name):
+    dynamodb.delete_item(
+        TableName=INDEX_TABLE_NAME,
+        Key=index_key(function_name, table_name)
+    )
+
+def bump_index_version():
+    # Returns the new version; called after every batch of index changes
+    response = dynamodb.update_item(
+        TableName=INDEX_TABLE_NAME,
+        Key=index_key(INDEX_VERSION_NAME, INDEX_VERSION_NAME),
+        UpdateExpression='ADD version :one SET updated_at = :now',
+        ExpressionAttributeValues={':one': {'N': '1'}, ':now': {'N': str(time.time())}},
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response['Attributes']['version']['N'])
+
+def read_index_version():
+    # Returns 0 before the first write
+    response = dynamodb.get_item(
+        TableName=INDEX_TABLE_NAME,
+        Key=index_key(INDEX_VERSION_NAME, INDEX_VERSION_NAME),
+        ProjectionExpression='version'
+    )
+    return int(response.get('Item', {}).get('version', {}).get('N', '0'))
+
+def query_function(function_name):
+    # Returns the index items of an exact function name; the reserved version name has none
+    items = []
+    paginator = dynamodb.get_paginator('query')
+    pages = paginator.paginate(
+        TableName=INDEX_TABLE_NAME,
+        KeyConditionExpression='function_name = :function_name',
+        ExpressionAttributeValues={':function_name': {'S': function_name}}
+    )
+    for page in pages:
+        items.extend(item for item in page['Items'] if not is_version_item(item))
+    return items
+
+def lookup_function(function_name):
+    # Returns [(table_name, file_name)] for an exact function name
+    return [(item['table_name']['S'], item['file_name']['S']) for item in query_function(function_name)]
+
+def index_key(function_name, table_name):
+    return {
+        'function_name': {'S': function_name},
+        'table_name': {'S': table_name}
+    }
+
+def batch_write_index(put_items=(), delete_keys=()):
+    batch_write_table(INDEX_TABLE_NAME, put_items, delete_keys)
+
+def iter_handler_items(table_names=None):
+    # Yields (table_name, file_name, function_name) for every entry of the handler tables
+    for table_name in table_names or list_handler_tables():
+        for page in dynamodb.get_paginator('scan').paginate(TableName=table_name):
+            for item in page['Items']:
+                if 'file_name' not in item:
+                    continue
+                for function_name in read_function_names(item):
+                    yield table_name, item['file_name']['S'], function_name
+
+def backfill_index(table_names=None):
+    items = [
+        index_item(function_name, table_name, file_name)
+        for table_name, file_name, function_name in iter_handler_items(table_names)
+    ]
+    batch_write_index(put_items=items)
+    bump_index_version()
+    print(f"Indexed {len(items)} functions into {INDEX_TABLE_NAME}")
+    return len(items)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['create']:
+        create_index_table()
+    elif sys.argv[1:2] == ['backfill']:
+        backfill_index(sys.argv[2:] or None)
+    else:
+        print("usage: python function_index.py create | backfill [table ...]")
@@ -0,0 +1,101 @@
+# Cached read side of the function index, served by the query API in hello.py.
+#
+# Lookups come from an in-process cache. An entry expires after
+# LOOKUP_CACHE_TTL seconds, and the whole cache is dropped as soon as the
+# index version stamp (bumped by every index writer) changes. The stamp is
+# re-read at most every LOOKUP_VERSION_INTERVAL seconds, so polling clients
+# cost one GetItem per interval instead of a Query per function name.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from function_index import query_function, read_index_version
+
+LOOKUP_CACHE_TTL = float(os.environ.get('LOOKUP_CACHE_TTL', '300'))
+LOOKUP_VERSION_INTERVAL = float(os.environ.get('LOOKUP_VERSION_INTERVAL', '5'))
+LOOKUP_CACHE_MAX_ENTRIES = int(os.environ.get('LOOKUP_CACHE_MAX_ENTRIES', '10000'))
+
+# Names accepted by one bulk lookup, and index queries sent concurrently for it
+LOOKUP_BULK_LIMIT = 100
+LOOKUP_QUERY_WORKERS = 8
+
+_lock = threading.Lock()
+
+# function_name -> (expires_at, locations)
+_entries = OrderedDict()
+
+_version = {'value': None, 'checked_at': 0.0}
+
+
+def current_index_version():
+    now = time.monotonic()
+    with _lock:
+        if _version['value'] is not None and now - _version['checked_at'] < LOOKUP_VERSION_INTERVAL:
+            return _version['value']
+
+    version = read_index_version()
+    with _lock:
+        if version != _version['value']:
+            _entries.clear()
+        _version['value'] = version
+        _version['checked_at'] = now
+    return version
+
+def _locations(items):
+    return sorted(
+        (
+            {
+                'handler': item['table_name']['S'],
+                'file_name': item['file_name']['S'],
+                'template': item.get('folder_name', {}).get('S')
+            }
+            for item in items
+        ),
+        key=lambda location: (location['handler'], location['file_name'])
+    )
+
+def _query_locations(function_names):
+    if len(function_names) == 1:
+        return {function_names[0]: _locations(query_function(function_names[0]))}
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(LOOKUP_QUERY_WORKERS, len(function_names))) as pool:
+        items = pool.map(query_function, function_names)
+        return {function_name: _locations(found) for function_name, found in zip(function_names, items)}
+
+def lookup_functions(function_names):
+    # Returns (index version, function_name -> [location]); unknown names map to []
+    version = current_index_version()
+    now = time.monotonic()
+
+    results = {}
+    missing = []
+    with _lock:
+        for function_name in dict.fromkeys(function_names):
+            entry = _entries.get(function_name)
+            if entry is not None and entry[0] > now:
+                _entries.move_to_end(function_name)
+                results[function_name] = entry[1]
+            else:
+                missing.append(function_name)
+
+    if missing:
+        found = _query_locations(missing)
+        results.update(found)
+        with _lock:
+            # Unknown names are cached too, since pollers keep asking for them
+            for function_name, locations in found.items():
+                _entries[function_name] = (now + LOOKUP_CACHE_TTL, locations)
+                _entries.move_to_end(function_name)
+            while len(_entries) > LOOKUP_CACHE_MAX_ENTRIES:
+                _entries.popitem(last=False)
+
+    return version, results
+
+def clear_lookup_cache():
+    with _lock:
+        _entries.clear()
+        _version['value'] = None
+        _version['checked_at'] = 0.0
@@ -0,0 +1,275 @@
+# Item operations on the per-handler tables.
+#
+# function_name is stored as a DynamoDB String Set and changed with single
+# ADD/DELETE update expressions, so concurrent invocations cannot lose each
+# other's writes. Items written before the switch hold a comma-joined string;
+# they are read transparently and converted the first time they are updated.
+# To convert every existing item in one go:
+#
+#   python handler_tables.py convert [table ...]
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from aws_clients import LazyClient
+from aws_metrics import is_throttled
+
+dynamodb = LazyClient('dynamodb')
+
+# PROVISIONED (5 RCU / 5 WCU) or PAY_PER_REQUEST for newly created handler tables
+TABLE_BILLING_MODE = os.environ.get('TABLE_BILLING_MODE', 'PROVISIONED')
+
+# How long a table seen ACTIVE is trusted without another describe_table
+TABLE_CACHE_TTL = float(os.environ.get('TABLE_CACHE_TTL', '300'))
+TABLE_CACHE_MAX_ENTRIES = int(os.environ.get('TABLE_CACHE_MAX_ENTRIES', '512'))
+
+_lock = threading.Lock()
+
+# table_name -> expiry time; module scope so it survives warm invocations
+_active_tables = OrderedDict()
+
+
+def _cache_active_table(table_name):
+    with _lock:
+        _active_tables[table_name] = time.monotonic() + TABLE_CACHE_TTL
+        _active_tables.move_to_end(table_name)
+        while len(_active_tables) > TABLE_CACHE_MAX_ENTRIES:
+            _active_tables.popitem(last=False)
+
+def _is_cached_active(table_name):
+    with _lock:
+        expires_at = _active_tables.get(table_name)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _active_tables[table_name]
+            return False
+        _active_tables.move_to_end(table_name)
+        return True
+
+def wait_for_table(table_name):
+    dynamodb.get_waiter('table_exists').wait(
+        TableName=table_name,
+        WaiterConfig={'Delay': 1, 'MaxAttempts': 60}
+    )
+    _cache_active_table(table_name)
+
+def does_table_exist(table_name):
+    if _is_cached_active(table_name):
+        return True
+    try:
+        status = dynamodb.describe_table(TableName=table_name)['Table']['TableStatus']
+    except dynamodb.exceptions.ResourceNotFoundException:
+        return False
+
+    if status == 'CREATING':
+        wait_for_table(table_name)
+    elif status == 'ACTIVE':
+        _cache_active_table(table_name)
+    return True
+
+def create_table(table_name):
+    kwargs = {
+        'TableName': table_name,
+        'KeySchema': [
+            {
+                'AttributeName': 'file_name',
+                'KeyType': 'HASH'
+            }
+        ],
+        'AttributeDefinitions': [
+            {
+                'AttributeName': 'file_name',
+                'AttributeType': 'S'
+            }
+        ]
+    }
+    if TABLE_BILLING_MODE == 'PAY_PER_REQUEST':
+        kwargs['BillingMode'] = 'PAY_PER_REQUEST'
+    else:
+        kwargs['ProvisionedThroughput'] = {
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+
+    # Errors, including a waiter timeout, are raised: registering into a missing table must
+    # fail the push rather than let the checkpoint move past it
+    try:
+        dynamodb.create_table(**kwargs)
+    except dynamodb.exceptions.ResourceInUseException:
+        # Another invocation is already creating it
+        pass
+    wait_for_table(table_name)
+    return {
+        'statusCode': 200,
+        'body': 'Table created successfully'
+    }
+
+def read_function_names(item):
+    # Accepts both String Set items and legacy comma-joined strings
+    value = item.get('function_name', {})
+    if 'SS' in value:
+        return set(value['SS'])
+    return {name for name in value.get('S', '').split(',') if name}
+
+def convert_item_to_string_set(table_name, file_name):
+    key = {'file_name': {'S': file_name}}
+    response = dynamodb.get_item(TableName=table_name, Key=key, ConsistentRead=True)
+    item = response.get('Item')
+
+    if not item or 'S' not in item.get('function_name', {}):
+        return False
+
+    function_names = read_function_names(item)
+    values = {':legacy': item['function_name']}
+    if function_names:
+        update_expression = 'SET #function_name = :function_names'
+        values[':function_names'] = {'SS': sorted(function_names)}
+    else:
+        # String Sets cannot be empty
+        update_expression = 'REMOVE #function_name'
+
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key=key,
+            UpdateExpression=update_expression,
+            ConditionExpression='#function_name = :legacy',
+            ExpressionAttributeNames={'#function_name': 'function_name'},
+            ExpressionAttributeValues=values
+        )
+        return True
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        # Someone else converted or rewrote the item in the meantime
+        return False
+
+def add_function_to_file_name_item(table_name, file_name, function_name, folder_name=None):
+    # ADD creates the item and the set when missing and is a no-op for existing members
+    update_expression = 'ADD #function_name :function_name'
+    values = {':function_name': {'SS': [function_name]}}
+    if folder_name is not None:
+        update_expression += ' SET folder_name = if_not_exists(folder_name, :folder_name)'
+        values[':folder_name'] = {'S': folder_name}
+
+    for attempt in range(2):
+        try:
+            dynamodb.update_item(
+                TableName=table_name,
+                Key={'file_name': {'S': file_name}},
+                UpdateExpression=update_expression,
+                ExpressionAttributeNames={'#function_name': 'function_name'},
+                ExpressionAttributeValues=values
+            )
+            return
+        except dynamodb.exceptions.ClientError as e:
+            # ADD fails with a type mismatch on legacy comma-string items
+            if attempt == 0 and e.response['Error']['Code'] == 'ValidationException':
+                convert_item_to_string_set(table_name, file_name)
+                continue
+            raise
+
+def remove_function(table_name, partition_key_value, value_to_remove):
+    attribute_name = 'function_name'
+
+    for attempt in range(2):
+        try:
+            # contains() on a set is an exact membership test, so the condition replaces the read
+            dynamodb.update_item(
+                TableName=table_name,
+                Key={'file_name': {'S': partition_key_value}},
+                UpdateExpression='DELETE #function_name :function_name',
+                ConditionExpression='contains(#function_name, :name)',
+                ExpressionAttributeNames={'#function_name': attribute_name},
+                ExpressionAttributeValues={
+                    ':function_name': {'SS': [value_to_remove]},
+                    ':name': {'S': value_to_remove}
+                }
+            )
+            print(f"Removed '{value_to_remove}' from '{attribute_name}' in table {table_name}")
+            return True
+        except dynamodb.exceptions.ClientError as e:
+            code = e.response['Error']['Code']
+            if code == 'ConditionalCheckFailedException':
+                print(f"'{value_to_remove}' not found in '{attribute_name}' in table {table_name}")
+                return False
+            # DELETE fails with a type mismatch on legacy comma-string items
+            if attempt == 0 and code == 'ValidationException':
+                convert_item_to_string_set(table_name, partition_key_value)
+                continue
+            # Throttling outlasted botocore's retries; the commit must fail, not lose the removal
+            if is_throttled(e.response):
+                raise
+            print(f"An error occurred: {e}")
+            return False
+
+    return False
+
+def batch_write_table(table_name, put_items=(), delete_keys=()):
+    requests = [{'PutRequest': {'Item': item}} for item in put_items]
+    requests.extend({'DeleteRequest': {'Key': key}} for key in delete_keys)
+
+    for start in range(0, len(requests), 25):
+        pending = {table_name: requests[start:start + 25]}
+        attempt = 0
+        while pending:
+            if attempt:
+                # Back off before resending items DynamoDB could not process
+                time.sleep(min(0.05 * 2 ** attempt, 2))
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems') or {}
+            attempt += 1
+
+def batch_get_items(keys_by_table):
+    # Returns table_name -> [item] for the keys that exist. Reads are strongly consistent,
+    # since callers skip writes based on what comes back.
+    requests = [(table_name, key) for table_name, keys in keys_by_table.items() for key in keys]
+    items = {table_name: [] for table_name in keys_by_table}
+
+    for start in range(0, len(requests), 100):
+        pending = {}
+        for table_name, key in requests[start:start + 100]:
+            pending.setdefault(table_name, {'Keys': [], 'ConsistentRead': True})['Keys'].append(key)
+        attempt = 0
+        while pending:
+            if attempt:
+                # Back off before asking again for keys DynamoDB could not read
+                time.sleep(min(0.05 * 2 ** attempt, 2))
+            response = dynamodb.batch_get_item(RequestItems=pending)
+            for table_name, found in response.get('Responses', {}).items():
+                items[table_name].extend(found)
+            pending = response.get('UnprocessedKeys') or {}
+            attempt += 1
+    return items
+
+def list_handler_tables():
+    # Handler tables are the ones keyed by file_name alone
+    table_names = []
+    for page in dynamodb.get_paginator('list_tables').paginate():
+        for table_name in page['TableNames']:
+            key_schema = dynamodb.describe_table(TableName=table_name)['Table']['KeySchema']
+            if [key['AttributeName'] for key in key_schema] == ['file_name']:
+                table_names.append(table_name)
+    return table_names
+
+def convert_tables_to_string_sets(table_names=None):
+    converted = 0
+    for table_name in table_names or list_handler_tables():
+        pages = dynamodb.get_paginator('scan').paginate(
+            TableName=table_name,
+            ProjectionExpression='file_name, function_name'
+        )
+        for page in pages:
+            for item in page['Items']:
+                if 'S' in item.get('function_name', {}):
+                    if convert_item_to_string_set(table_name, item['file_name']['S']):
+                        converted += 1
+    print(f"Converted {converted} items to String Sets")
+    return converted
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['convert']:
+        convert_tables_to_string_sets(sys.argv[2:] or None)
+    else:
+        print("usage: python handler_tables.py convert [table ...]")
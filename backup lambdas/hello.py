@@ -1,9 +1,77 @@
-from flask import Flask
+from flask import Flask, abort, jsonify, request
+
+from function_lookup import LOOKUP_BULK_LIMIT, lookup_functions
+from webhook_ingest import QueueFull, enqueue_event, ingest_stats
+
 app = Flask(__name__)
 
 @app.route("/")
 def hello():
     return "Hello from Python!"
 
+def conditional_json(payload, index_version, status=200):
+    # The ETag covers the payload only, so a version bump that leaves it unchanged still gets a 304.
+    # Only 200s are conditional: a 304 for an unknown function would read as a cached success
+    response = jsonify(payload)
+    response.status_code = status
+    response.headers['X-Index-Version'] = str(index_version)
+    if status != 200:
+        return response
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route("/functions/<function_name>")
+def get_function(function_name):
+    index_version, results = lookup_functions([function_name])
+    locations = results[function_name]
+    return conditional_json(
+        {'function_name': function_name, 'locations': locations},
+        index_version,
+        200 if locations else 404
+    )
+
+@app.route("/functions", methods=["GET", "POST"])
+def get_functions():
+    # GET /functions?name=a&name=b (or name=a,b) is cacheable; POST {"function_names": [...]} suits long lists
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        function_names = body.get('function_names')
+        if not isinstance(function_names, list) or not all(isinstance(name, str) for name in function_names):
+            abort(400, description='Expected {"function_names": [...]}')
+    else:
+        function_names = [
+            name for value in request.args.getlist('name') for name in value.split(',') if name
+        ]
+
+    if not function_names:
+        abort(400, description='No function names given')
+    if len(function_names) > LOOKUP_BULK_LIMIT:
+        abort(400, description=f'At most {LOOKUP_BULK_LIMIT} function names per request')
+
+    index_version, results = lookup_functions(function_names)
+    return conditional_json({'functions': results}, index_version)
+
+@app.route("/webhooks/codecommit", methods=["POST"])
+def codecommit_webhook():
+    # Same payload as the Lambda trigger; acknowledged as soon as it is queued
+    event = request.get_json(silent=True)
+    if not isinstance(event, dict):
+        abort(400, description='Expected a JSON CodeCommit push event')
+    try:
+        queued = enqueue_event(event)
+    except ValueError as e:
+        abort(400, description=str(e))
+    except QueueFull as e:
+        # Pushes already queued from this event are skipped as processed when it is redelivered
+        response = jsonify({'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    return jsonify({'queued': queued}), 202
+
+@app.route("/webhooks/status")
+def webhook_status():
+    return jsonify(ingest_stats())
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0')
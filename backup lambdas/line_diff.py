@@ -0,0 +1,123 @@
+# Line-level diff engine.
+#
+# The change extractor compares parsed templates (see template_diff) and no
+# longer diffs lines; this engine is kept for line-based comparisons of
+# template text and is measured against difflib by bench_line_diff.py.
+#
+# The default mode treats both sides as multisets of lines: every line is
+# hashed once and counted, so added/removed lines come out in linear time no
+# matter how the file was reshuffled. The exact mode runs Myers' O((N+M)D)
+# algorithm and returns an ordered edit script for callers that need hunk
+# context.
+from collections import Counter
+
+
+def multiset_changes(before_lines, after_lines):
+    before_counts = Counter(before_lines)
+    after_counts = Counter(after_lines)
+
+    added = []
+    for line in after_lines:
+        # Only lines that occur more often after the commit than before it are new
+        if before_counts[line] > 0:
+            before_counts[line] -= 1
+        else:
+            added.append(line)
+
+    removed = []
+    for line in before_lines:
+        if after_counts[line] > 0:
+            after_counts[line] -= 1
+        else:
+            removed.append(line)
+
+    return added, removed
+
+def _myers_trace(a, b):
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+
+    for d in range(n + m + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+
+            v[k] = x
+            if x >= n and y >= m:
+                return trace
+
+    return trace
+
+def myers_edit_script(before_lines, after_lines):
+    # Returns [(tag, line)] where tag is '=', '-' or '+', in file order
+    start = 0
+    limit = min(len(before_lines), len(after_lines))
+    while start < limit and before_lines[start] == after_lines[start]:
+        start += 1
+
+    end_before, end_after = len(before_lines), len(after_lines)
+    while end_before > start and end_after > start and before_lines[end_before - 1] == after_lines[end_after - 1]:
+        end_before -= 1
+        end_after -= 1
+
+    # Map lines to ints so comparisons during the search are cheap
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in before_lines[start:end_before]]
+    b = [ids.setdefault(line, len(ids)) for line in after_lines[start:end_after]]
+    trace = _myers_trace(a, b)
+
+    middle = []
+    x, y = len(a), len(b)
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+
+        while x > prev_x and y > prev_y:
+            middle.append(('=', before_lines[start + x - 1]))
+            x -= 1
+            y -= 1
+
+        if d > 0:
+            if x == prev_x:
+                middle.append(('+', after_lines[start + y - 1]))
+            else:
+                middle.append(('-', before_lines[start + x - 1]))
+
+        x, y = prev_x, prev_y
+
+    middle.reverse()
+
+    script = [('=', line) for line in before_lines[:start]]
+    script.extend(middle)
+    script.extend(('=', line) for line in before_lines[end_before:])
+    return script
+
+def line_changes(before_lines, after_lines, exact=False):
+    # Returns (added_lines, removed_lines)
+    if not exact:
+        return multiset_changes(before_lines, after_lines)
+
+    added = []
+    removed = []
+    for tag, line in myers_edit_script(before_lines, after_lines):
+        if tag == '+':
+            added.append(line)
+        elif tag == '-':
+            removed.append(line)
+
+    return added, removed
@@ -0,0 +1,248 @@
+# Collects the index mutations of a commit and applies them in bulk.
+#
+# Handler-table changes are String Set ADD/DELETE updates, which
+# BatchWriteItem cannot express, so they are grouped per item and sent
+# through TransactWriteItems. Reverse-index entries are whole-item puts and
+# deletes and go through BatchWriteItem with UnprocessedItems retried.
+#
+# Before anything is written, every handler item and index entry the plan
+# touches is read in one BatchGetItem pass and the plan is reduced to the
+# writes that change something. A push whose functions are already indexed
+# (a redelivered event, a rebuilt checkpoint) therefore writes nothing and
+# leaves the index version alone. With dry_run the reduced plan is only
+# printed.
+from aws_clients import LazyClient
+from aws_metrics import is_throttled
+from function_index import INDEX_TABLE_NAME, batch_write_index, bump_index_version, index_item, index_key
+from handler_tables import (
+    add_function_to_file_name_item, batch_get_items, does_table_exist, read_function_names, remove_function
+)
+
+TRANSACTION_SIZE = 25
+
+dynamodb = LazyClient('dynamodb')
+
+
+def new_mutation_plan():
+    return {
+        # (table_name, file_name) -> {'folder_name': str, 'functions': set}
+        'additions': {},
+        # (table_name, file_name) -> set of function names
+        'removals': {}
+    }
+
+def plan_registration(plan, table_name, file_name, folder_name, function_name):
+    entry = plan['additions'].setdefault((table_name, file_name), {'folder_name': folder_name, 'functions': set()})
+    entry['functions'].add(function_name)
+
+def plan_removal(plan, table_name, file_name, function_name):
+    plan['removals'].setdefault((table_name, file_name), set()).add(function_name)
+
+def plan_is_empty(plan):
+    return not plan['additions'] and not plan['removals']
+
+def _net_removals(plan):
+    # A function removed and re-added on the same item within one commit stays registered
+    removals = {}
+    for key, function_names in plan['removals'].items():
+        added = plan['additions'].get(key, {}).get('functions', set())
+        remaining = function_names - added
+        if remaining:
+            removals[key] = remaining
+    return removals
+
+def _removal_action(table_name, file_name, function_names):
+    # Deleting a non-member from a set is a no-op, so no condition is needed
+    return {
+        'Update': {
+            'TableName': table_name,
+            'Key': {'file_name': {'S': file_name}},
+            'UpdateExpression': 'DELETE #function_name :function_names',
+            'ExpressionAttributeNames': {'#function_name': 'function_name'},
+            'ExpressionAttributeValues': {':function_names': {'SS': sorted(function_names)}}
+        }
+    }
+
+def _addition_action(table_name, file_name, folder_name, function_names):
+    return {
+        'Update': {
+            'TableName': table_name,
+            'Key': {'file_name': {'S': file_name}},
+            'UpdateExpression': 'ADD #function_name :function_names SET folder_name = if_not_exists(folder_name, :folder_name)',
+            'ExpressionAttributeNames': {'#function_name': 'function_name'},
+            'ExpressionAttributeValues': {
+                ':function_names': {'SS': sorted(function_names)},
+                ':folder_name': {'S': folder_name}
+            }
+        }
+    }
+
+def _apply_individually(action):
+    # Per-item fallback; the handler_tables helpers convert legacy comma-string items
+    update = action['Update']
+    table_name = update['TableName']
+    file_name = update['Key']['file_name']['S']
+    function_names = update['ExpressionAttributeValues'][':function_names']['SS']
+
+    if update['UpdateExpression'].startswith('DELETE'):
+        for function_name in function_names:
+            remove_function(table_name, file_name, function_name)
+    else:
+        folder_name = update['ExpressionAttributeValues'][':folder_name']['S']
+        for function_name in function_names:
+            add_function_to_file_name_item(table_name, file_name, function_name, folder_name)
+
+def transact_chunk(chunk):
+    try:
+        dynamodb.transact_write_items(TransactItems=chunk)
+    except dynamodb.exceptions.ClientError as e:
+        # Falling back to 2 x 25 single updates would only add load to a throttled table,
+        # whether the whole call or only one of its items was throttled
+        if is_throttled(e.response):
+            raise
+        # One legacy item or a conflicting writer cancels the whole transaction
+        print(f"Transaction of {len(chunk)} updates failed, applying individually: {e}")
+        for action in chunk:
+            _apply_individually(action)
+
+def transaction_chunks(actions):
+    return [actions[start:start + TRANSACTION_SIZE] for start in range(0, len(actions), TRANSACTION_SIZE)]
+
+def read_plan_state(plan):
+    # Returns the current state of everything the plan touches, read in one batch:
+    #   'handler': (table_name, file_name) -> {'folder_name': str or None, 'functions': set}
+    #   'index':   (function_name, table_name) -> index item
+    item_keys = plan['additions'].keys() | plan['removals'].keys()
+    function_keys = {
+        (function_name, table_name)
+        for (table_name, _), entry in plan['additions'].items()
+        for function_name in entry['functions']
+    }
+    function_keys.update(
+        (function_name, table_name)
+        for (table_name, _), function_names in plan['removals'].items()
+        for function_name in function_names
+    )
+
+    # A table that does not exist yet has no items, and BatchGetItem would fail on it
+    existing_tables = {table_name for table_name in {table_name for table_name, _ in item_keys} if does_table_exist(table_name)}
+    keys_by_table = {}
+    for table_name, file_name in sorted(item_keys):
+        if table_name in existing_tables:
+            keys_by_table.setdefault(table_name, []).append({'file_name': {'S': file_name}})
+    if function_keys:
+        keys_by_table[INDEX_TABLE_NAME] = [index_key(*key) for key in sorted(function_keys)]
+
+    items = batch_get_items(keys_by_table)
+    return {
+        'handler': {
+            (table_name, item['file_name']['S']): {
+                'folder_name': item.get('folder_name', {}).get('S'),
+                'functions': read_function_names(item)
+            }
+            for table_name, table_items in items.items() if table_name != INDEX_TABLE_NAME
+            for item in table_items
+        },
+        'index': {
+            (item['function_name']['S'], item['table_name']['S']): item
+            for item in items.get(INDEX_TABLE_NAME, [])
+        }
+    }
+
+def _item_delta(removals, additions, handler_state):
+    # Drops removals of functions an item does not list and additions of ones it already does
+    empty = {'functions': set()}
+    removal_delta = {}
+    for key, function_names in removals.items():
+        present = function_names & handler_state.get(key, empty)['functions']
+        if present:
+            removal_delta[key] = present
+    addition_delta = {}
+    for key, entry in additions.items():
+        absent = entry['functions'] - handler_state.get(key, empty)['functions']
+        if absent:
+            addition_delta[key] = {'folder_name': entry['folder_name'], 'functions': absent}
+    return removal_delta, addition_delta
+
+def plan_writes(plan, state=None):
+    # Returns (removal_actions, addition_actions, index_puts, index_deletes); the removals
+    # must be applied before the additions and both before the index writes. With the
+    # state from read_plan_state only the writes that change something are returned.
+    removals = _net_removals(plan)
+    additions = plan['additions']
+    item_removals, item_additions = removals, additions
+    if state is not None:
+        item_removals, item_additions = _item_delta(removals, additions, state['handler'])
+
+    # Each item appears at most once per phase, which TransactWriteItems requires
+    removal_actions = [
+        _removal_action(table_name, file_name, function_names)
+        for (table_name, file_name), function_names in item_removals.items()
+    ]
+    addition_actions = [
+        _addition_action(table_name, file_name, entry['folder_name'], entry['functions'])
+        for (table_name, file_name), entry in item_additions.items()
+    ]
+
+    # Index entries come from the full plan, so an entry that drifted from an up-to-date
+    # handler item is still repaired. BatchWriteItem rejects duplicate keys within a
+    # request, so dedupe across both lists.
+    puts = {}
+    for (table_name, file_name), entry in additions.items():
+        for function_name in entry['functions']:
+            puts[(function_name, table_name)] = index_item(function_name, table_name, file_name, entry['folder_name'])
+    deletes = {
+        (function_name, table_name): index_key(function_name, table_name)
+        for (table_name, _), function_names in removals.items()
+        for function_name in function_names
+        if (function_name, table_name) not in puts
+    }
+    if state is not None:
+        puts = {key: item for key, item in puts.items() if state['index'].get(key) != item}
+        deletes = {key: deletes[key] for key in deletes if key in state['index']}
+    return removal_actions, addition_actions, list(puts.values()), list(deletes.values())
+
+def writes_are_empty(writes):
+    return not any(writes)
+
+def print_writes(writes):
+    removal_actions, addition_actions, index_puts, index_deletes = writes
+    print(
+        f"Plan: {len(removal_actions)} removal and {len(addition_actions)} addition item updates, "
+        f"{len(index_puts)} index puts, {len(index_deletes)} index deletes"
+    )
+    for sign, actions in (('-', removal_actions), ('+', addition_actions)):
+        for action in actions:
+            update = action['Update']
+            function_names = ', '.join(update['ExpressionAttributeValues'][':function_names']['SS'])
+            print(f"  {sign} {update['TableName']}/{update['Key']['file_name']['S']}: {function_names}")
+    for item in index_puts:
+        print(f"  index + {item['function_name']['S']} -> {item['table_name']['S']}/{item['file_name']['S']}")
+    for key in index_deletes:
+        print(f"  index - {key['function_name']['S']} @ {key['table_name']['S']}")
+
+def clear_plan(plan):
+    plan['additions'] = {}
+    plan['removals'] = {}
+
+def flush_mutation_plan(plan, dry_run=False):
+    writes = plan_writes(plan, read_plan_state(plan))
+    removal_actions, addition_actions, index_puts, index_deletes = writes
+    if dry_run:
+        print_writes(writes)
+        clear_plan(plan)
+        return
+    if writes_are_empty(writes):
+        print("Index already up to date, nothing to write")
+        clear_plan(plan)
+        return
+
+    for chunk in transaction_chunks(removal_actions):
+        transact_chunk(chunk)
+    for chunk in transaction_chunks(addition_actions):
+        transact_chunk(chunk)
+    batch_write_index(put_items=index_puts, delete_keys=index_deletes)
+    bump_index_version()
+
+    print(f"Flushed {len(removal_actions)} removal and {len(addition_actions)} addition item updates")
+    clear_plan(plan)
@@ -0,0 +1,240 @@
+# Per-table client-side rate limiting for DynamoDB, through botocore event hooks.
+#
+# Every provisioned table gets a read and a write token bucket that refills at
+# RATE_LIMIT_UTILIZATION of the table's provisioned capacity, as reported by
+# describe_table. The capacity is re-read every RATE_LIMIT_CAPACITY_TTL
+# seconds. Before a call, its estimated capacity units are reserved and the
+# caller sleeps if the bucket is in debt. ReturnConsumedCapacity is requested
+# on every call, so the estimate is then corrected to what DynamoDB actually
+# charged. A throttling response halves the bucket's rate, and successful
+# calls grow it back towards the target (additive increase, multiplicative
+# decrease). On-demand tables are not paced. Time spent waiting is reported
+# per operation through aws_metrics and per table through limiter_stats().
+import os
+import threading
+import time
+
+from aws_metrics import is_throttled, record_wait
+
+RATE_LIMIT_UTILIZATION = float(os.environ.get('RATE_LIMIT_UTILIZATION', '0.9'))
+RATE_LIMIT_CAPACITY_TTL = float(os.environ.get('RATE_LIMIT_CAPACITY_TTL', '300'))
+
+# Unused capacity a bucket may save up, in seconds of its rate
+RATE_LIMIT_BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', '1'))
+
+# Throttling multiplies the rate by BACKOFF; each success adds RECOVERY of the target rate
+RATE_LIMIT_BACKOFF = 0.5
+RATE_LIMIT_RECOVERY = 0.05
+# Lowest rate as a fraction of the target, so a bucket never stalls completely
+RATE_LIMIT_FLOOR = 0.1
+
+# Operation -> capacity kind; transactions cost twice the units of plain requests
+READ_OPERATIONS = {'GetItem': 1, 'Query': 1, 'Scan': 1, 'BatchGetItem': 1, 'TransactGetItems': 2}
+WRITE_OPERATIONS = {'PutItem': 1, 'UpdateItem': 1, 'DeleteItem': 1, 'BatchWriteItem': 1, 'TransactWriteItems': 2}
+
+_lock = threading.Lock()
+
+# table_name -> {'expires_at': float, 'read': bucket or None, 'write': bucket or None}
+_tables = {}
+
+_stats = {}
+
+
+def _new_bucket(units_per_second):
+    target = units_per_second * RATE_LIMIT_UTILIZATION
+    return {
+        'target': target,
+        'rate': target,
+        'tokens': target * RATE_LIMIT_BURST_SECONDS,
+        'updated_at': time.monotonic(),
+        'lock': threading.Lock()
+    }
+
+def _refill(bucket, now):
+    elapsed = now - bucket['updated_at']
+    bucket['tokens'] = min(bucket['tokens'] + elapsed * bucket['rate'], bucket['rate'] * RATE_LIMIT_BURST_SECONDS)
+    bucket['updated_at'] = now
+
+def _reserve(bucket, units):
+    # Takes units (possibly into debt) and returns how long the caller must wait to pay it off
+    with bucket['lock']:
+        now = time.monotonic()
+        _refill(bucket, now)
+        bucket['tokens'] -= units
+        return -bucket['tokens'] / bucket['rate'] if bucket['tokens'] < 0 else 0.0
+
+def _charge(bucket, units):
+    # Positive units are taken, negative ones returned, without waiting
+    with bucket['lock']:
+        _refill(bucket, time.monotonic())
+        bucket['tokens'] -= units
+
+def _slow_down(bucket):
+    with bucket['lock']:
+        bucket['rate'] = max(bucket['rate'] * RATE_LIMIT_BACKOFF, bucket['target'] * RATE_LIMIT_FLOOR)
+
+def _speed_up(bucket):
+    with bucket['lock']:
+        bucket['rate'] = min(bucket['rate'] + bucket['target'] * RATE_LIMIT_RECOVERY, bucket['target'])
+
+def _table_stats(table_name):
+    stats = _stats.get(table_name)
+    if stats is None:
+        stats = _stats[table_name] = {
+            'wait_ms': 0.0, 'waits': 0, 'throttles': 0, 'read_units': 0.0, 'write_units': 0.0
+        }
+    return stats
+
+def _describe_buckets(client, table_name):
+    try:
+        table = client.describe_table(TableName=table_name)['Table']
+    except client.exceptions.ClientError:
+        # Missing tables fail the real call anyway; nothing to pace
+        return {'read': None, 'write': None}
+
+    if table.get('BillingModeSummary', {}).get('BillingMode') == 'PAY_PER_REQUEST':
+        return {'read': None, 'write': None}
+    throughput = table.get('ProvisionedThroughput', {})
+    read_units = throughput.get('ReadCapacityUnits') or 0
+    write_units = throughput.get('WriteCapacityUnits') or 0
+    return {
+        'read': _new_bucket(read_units) if read_units else None,
+        'write': _new_bucket(write_units) if write_units else None
+    }
+
+def _buckets(client, table_name):
+    with _lock:
+        entry = _tables.get(table_name)
+        if entry is not None and entry['expires_at'] > time.monotonic():
+            return entry
+
+    # Described outside the lock; DescribeTable is not paced, so this does not recurse
+    buckets = _describe_buckets(client, table_name)
+    with _lock:
+        entry = _tables.get(table_name)
+        if entry is not None:
+            # Keep the adaptive state of the old buckets when only the capacity was re-read
+            for kind in ('read', 'write'):
+                old, new = entry[kind], buckets[kind]
+                if old is not None and new is not None:
+                    new['rate'] = min(old['rate'], new['target'])
+                    new['tokens'] = min(old['tokens'], new['tokens'])
+        buckets['expires_at'] = time.monotonic() + RATE_LIMIT_CAPACITY_TTL
+        _tables[table_name] = buckets
+        return buckets
+
+def estimated_units(operation_name, params):
+    # Returns {table_name: units} for the tables the request touches
+    multiplier = READ_OPERATIONS.get(operation_name) or WRITE_OPERATIONS.get(operation_name)
+    if operation_name in ('BatchWriteItem', 'BatchGetItem'):
+        return {
+            table_name: multiplier * len(requests.get('Keys', []) if isinstance(requests, dict) else requests)
+            for table_name, requests in params.get('RequestItems', {}).items()
+        }
+    if operation_name in ('TransactWriteItems', 'TransactGetItems'):
+        units = {}
+        for action in params.get('TransactItems', []):
+            for request in action.values():
+                units[request['TableName']] = units.get(request['TableName'], 0) + multiplier
+        return units
+    units = multiplier
+    if operation_name == 'GetItem' and not params.get('ConsistentRead'):
+        # Eventually consistent reads cost half a unit
+        units = 0.5
+    return {params['TableName']: units}
+
+def _consumed_units(parsed):
+    consumed = parsed.get('ConsumedCapacity')
+    if consumed is None:
+        return None
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    units = {}
+    for entry in consumed:
+        units[entry['TableName']] = units.get(entry['TableName'], 0) + entry.get('CapacityUnits', 0)
+    return units
+
+def instrument_rate_limits(client):
+    events = client.meta.events
+
+    def provide_params(params=None, context=None, event_name='', **kwargs):
+        operation_name = event_name.rsplit('.', 1)[-1]
+        if params is None or context is None:
+            return None
+        kind = 'read' if operation_name in READ_OPERATIONS else 'write'
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+        reservations = []
+        waited = 0.0
+        for table_name, units in estimated_units(operation_name, params).items():
+            bucket = _buckets(client, table_name)[kind]
+            if bucket is None:
+                continue
+            wait = _reserve(bucket, units)
+            if wait:
+                time.sleep(wait)
+                waited += wait
+                with _lock:
+                    stats = _table_stats(table_name)
+                    stats['wait_ms'] += wait * 1000
+                    stats['waits'] += 1
+            reservations.append((table_name, bucket, units))
+
+        context['rate_limit'] = {'kind': kind, 'reservations': reservations}
+        if waited:
+            record_wait('dynamodb', operation_name, waited * 1000)
+        return None
+
+    def after_call(parsed=None, context=None, **kwargs):
+        state = (context or {}).get('rate_limit')
+        if state is None:
+            return
+        parsed = parsed or {}
+        consumed = _consumed_units(parsed)
+        throttled = is_throttled(parsed)
+
+        for table_name, bucket, units in state['reservations']:
+            if consumed is not None and table_name in consumed:
+                # Correct the up-front estimate to the units DynamoDB actually charged
+                _charge(bucket, consumed[table_name] - units)
+            if not throttled:
+                _speed_up(bucket)
+        with _lock:
+            for table_name, units in (consumed or {}).items():
+                _table_stats(table_name)[f"{state['kind']}_units"] += units
+
+    def needs_retry(response=None, request_dict=None, **kwargs):
+        # Observer only, like aws_metrics: slows the buckets down and leaves the retry to botocore
+        if not response:
+            return None
+        if not is_throttled(response[1] or {}):
+            return None
+        state = (request_dict or {}).get('context', {}).get('rate_limit')
+        if state is None:
+            return None
+        for table_name, bucket, _ in state['reservations']:
+            _slow_down(bucket)
+            with _lock:
+                _table_stats(table_name)['throttles'] += 1
+        return None
+
+    for operation_name in {**READ_OPERATIONS, **WRITE_OPERATIONS}:
+        events.register(f'provide-client-params.dynamodb.{operation_name}', provide_params)
+        events.register(f'after-call.dynamodb.{operation_name}', after_call)
+        events.register(f'needs-retry.dynamodb.{operation_name}', needs_retry)
+    return client
+
+def limiter_stats(reset=False):
+    with _lock:
+        stats = {table_name: dict(table_stats) for table_name, table_stats in _stats.items()}
+        for table_name, entry in _tables.items():
+            for kind in ('read', 'write'):
+                if entry[kind] is not None:
+                    stats.setdefault(table_name, dict(_table_stats(table_name)))[f'{kind}_rate'] = round(entry[kind]['rate'], 2)
+        if reset:
+            _stats.clear()
+        return stats
+
+def reset_limiter_stats():
+    with _lock:
+        _stats.clear()
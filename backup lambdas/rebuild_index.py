@@ -0,0 +1,236 @@
+# Rebuilds the handler tables and the reverse index from a repository commit.
+#
+#   python rebuild_index.py <repository> [--commit main] [--workers 8] [--verify] [--prune]
+#   python rebuild_index.py /path/to/clone --source git --commit HEAD --verify
+#
+# Push events only ever change the index incrementally, so a missed or failed
+# event leaves drift behind for good. This lists every template at the commit
+# (one get_differences against the empty tree), fetches the blobs on the
+# handler's thread pool and parses them in a process pool. The result is the
+# complete expected index. Whatever differs from the live tables is written
+# with BatchWriteItem: handler items are replaced whole and index entries put.
+#
+# Handler tables can be fed by several repositories, so entries this
+# repository does not define are only deleted with --prune. --verify writes
+# nothing, prints the drift and exits non-zero when there is any. Pause
+# pushes to the repository while a rebuild writes, since whole-item puts can
+# overwrite a concurrent incremental update.
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import repository_sources
+from automatedscript_ostrum import (
+    build_mutation_plan, ensure_handler_table, extract_resource_names, iter_blobs,
+    iter_difference_pages, lookup_parsed_templates, select_changed_templates
+)
+from aws_clients import LazyClient
+from function_index import INDEX_TABLE_NAME, batch_write_index, bump_index_version, index_item, index_key, is_version_item
+from handler_tables import batch_write_table, list_handler_tables, read_function_names
+from template_cache import put_resources
+from template_diff import diff_template_functions
+
+dynamodb = LazyClient('dynamodb')
+
+# Drift lines printed per category
+REPORT_LIMIT = 20
+
+
+def load_templates(repository, commit_id, workers):
+    # Returns (file_path -> Resources map, paths that could not be parsed); fetch errors are raised
+    templates = {}
+    failed = []
+
+    # Workers are spawned rather than forked: the fetch threads run while the pool starts
+    # processes, and a child forked with a lock held by one of them can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = {}
+        for differences in iter_difference_pages(repository, None, commit_id):
+            # Against the empty tree every file is an addition
+            changed_files = select_changed_templates(differences)
+            parsed, missing = lookup_parsed_templates(changed_files)
+
+            # Submitted as each blob arrives, so parsing overlaps fetching the rest
+            fetched = {}
+            for blob_id, content in iter_blobs(repository, missing):
+                # Unreadable blobs are left out and reported as failed below
+                if content is not None:
+                    fetched[blob_id] = pool.submit(extract_resource_names, content)
+
+            for file_path, _, blob_id in changed_files:
+                if blob_id in parsed:
+                    templates[file_path] = parsed[blob_id]
+                elif blob_id in fetched:
+                    # Copies of one template share the blob and its parse
+                    pending.setdefault(fetched[blob_id], (blob_id, []))[1].append(file_path)
+                else:
+                    failed.append(file_path)
+
+        for future in as_completed(pending):
+            blob_id, file_paths = pending[future]
+            resources = future.result()
+            if not isinstance(resources, dict):
+                for file_path in file_paths:
+                    print(f"Failed to parse file {file_path}: {resources}")
+                failed.extend(file_paths)
+                continue
+            put_resources(blob_id, resources)
+            for file_path in file_paths:
+                templates[file_path] = resources
+
+    return templates, sorted(failed)
+
+def expected_items(templates):
+    # Returns (table_name, file_name) -> {'folder_name': str, 'functions': set}
+    function_diffs = {
+        file_path: diff_template_functions(None, templates[file_path])
+        for file_path in sorted(templates)
+    }
+    return build_mutation_plan(function_diffs)['additions']
+
+def scan_handler_items(table_names):
+    # Returns (table_name, file_name) -> {'folder_name': str or None, 'functions': set}
+    items = {}
+    for table_name in table_names:
+        try:
+            pages = dynamodb.get_paginator('scan').paginate(TableName=table_name)
+            for page in pages:
+                for item in page['Items']:
+                    if 'file_name' not in item:
+                        continue
+                    items[(table_name, item['file_name']['S'])] = {
+                        'folder_name': item.get('folder_name', {}).get('S'),
+                        'functions': read_function_names(item)
+                    }
+        except dynamodb.exceptions.ResourceNotFoundException:
+            continue
+    return items
+
+def scan_index_entries():
+    # Returns (function_name, table_name) -> file_name
+    entries = {}
+    for page in dynamodb.get_paginator('scan').paginate(TableName=INDEX_TABLE_NAME):
+        for item in page['Items']:
+            if not is_version_item(item):
+                entries[(item['function_name']['S'], item['table_name']['S'])] = item['file_name']['S']
+    return entries
+
+def compute_drift(expected, live_items, live_index, prune=False):
+    handler_puts = {}
+    for key in sorted(expected.keys() | (live_items.keys() if prune else set())):
+        entry = expected.get(key)
+        live = live_items.get(key)
+        functions = set(entry['functions']) if entry else set()
+        if live and not prune:
+            functions |= live['functions']
+        if live and functions == live['functions']:
+            continue
+        if functions or live:
+            # The first folder an item was registered from is kept, as in the incremental path
+            folder_name = (live or {}).get('folder_name') or (entry or {}).get('folder_name')
+            handler_puts[key] = {'folder_name': folder_name, 'functions': functions}
+
+    expected_index = {
+        (function_name, table_name): (file_name, entry['folder_name'])
+        for (table_name, file_name), entry in expected.items()
+        for function_name in entry['functions']
+    }
+    index_puts = {
+        key: location for key, location in expected_index.items()
+        if live_index.get(key) != location[0]
+    }
+    index_deletes = sorted(live_index.keys() - expected_index.keys()) if prune else []
+
+    return {'handler_puts': handler_puts, 'index_puts': index_puts, 'index_deletes': index_deletes}
+
+def drift_is_empty(drift):
+    return not any(drift.values())
+
+def print_drift(drift, live_items):
+    for (table_name, file_name), target in list(drift['handler_puts'].items())[:REPORT_LIMIT]:
+        live_functions = live_items.get((table_name, file_name), {}).get('functions', set())
+        missing = sorted(target['functions'] - live_functions)
+        stale = sorted(live_functions - target['functions'])
+        print(f"  {table_name}/{file_name}: missing {missing}, stale {stale}")
+    for (function_name, table_name), (file_name, _) in list(drift['index_puts'].items())[:REPORT_LIMIT]:
+        print(f"  index {function_name} -> {table_name}/{file_name} missing or wrong")
+    for function_name, table_name in drift['index_deletes'][:REPORT_LIMIT]:
+        print(f"  index {function_name} -> {table_name} stale")
+    print(
+        f"{len(drift['handler_puts'])} handler items, {len(drift['index_puts'])} index entries "
+        f"to write and {len(drift['index_deletes'])} index entries to delete"
+    )
+
+def apply_drift(drift):
+    puts_by_table = {}
+    deletes_by_table = {}
+    for (table_name, file_name), target in drift['handler_puts'].items():
+        if not target['functions']:
+            # String Sets cannot be empty, so an item without functions is deleted
+            deletes_by_table.setdefault(table_name, []).append({'file_name': {'S': file_name}})
+            continue
+        item = {
+            'file_name': {'S': file_name},
+            'function_name': {'SS': sorted(target['functions'])}
+        }
+        if target['folder_name']:
+            item['folder_name'] = {'S': target['folder_name']}
+        puts_by_table.setdefault(table_name, []).append(item)
+
+    for table_name in sorted(puts_by_table):
+        ensure_handler_table(table_name)
+    for table_name in sorted(puts_by_table.keys() | deletes_by_table.keys()):
+        batch_write_table(table_name, puts_by_table.get(table_name, ()), deletes_by_table.get(table_name, ()))
+
+    batch_write_index(
+        put_items=[
+            index_item(function_name, table_name, file_name, folder_name)
+            for (function_name, table_name), (file_name, folder_name) in drift['index_puts'].items()
+        ],
+        delete_keys=[index_key(function_name, table_name) for function_name, table_name in drift['index_deletes']]
+    )
+    bump_index_version()
+
+def rebuild_index(repository, commit_id, workers=None, verify=False, prune=False):
+    templates, failed = load_templates(repository, commit_id, workers or os.cpu_count())
+    print(f"Parsed {len(templates)} templates at {commit_id}")
+
+    expected = expected_items(templates)
+    table_names = set(list_handler_tables()) | {table_name for table_name, _ in expected}
+    live_items = scan_handler_items(sorted(table_names))
+    live_index = scan_index_entries()
+
+    drift = compute_drift(expected, live_items, live_index, prune)
+    print_drift(drift, live_items)
+
+    if verify:
+        return drift_is_empty(drift) and not failed
+    if failed:
+        # Their functions are unknown, so writing would drop them from the index
+        print(f"Not writing: {len(failed)} templates could not be read: {', '.join(failed[:REPORT_LIMIT])}")
+        return False
+    if not drift_is_empty(drift):
+        apply_drift(drift)
+        print("Index rebuilt")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('repository')
+    parser.add_argument('--commit', default='main', help='commit ID or branch name')
+    parser.add_argument('--workers', type=int, help='parser processes (default: CPU count)')
+    parser.add_argument('--verify', action='store_true', help='only report drift, exit 1 when there is any')
+    parser.add_argument('--prune', action='store_true', help='also delete entries no template defines')
+    parser.add_argument('--source', choices=('codecommit', 'git'), help='default: REPOSITORY_SOURCE')
+    args = parser.parse_args()
+
+    if args.source:
+        repository_sources.REPOSITORY_SOURCE = args.source
+
+    ok = rebuild_index(args.repository, args.commit, args.workers, args.verify, args.prune)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
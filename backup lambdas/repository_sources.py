@@ -0,0 +1,265 @@
+# Where commits, differences and blobs are read from.
+#
+# REPOSITORY_SOURCE picks the backend for every repository the indexer sees:
+#
+#   codecommit  the CodeCommit API (default)
+#   git         a local clone or mirror, read through one long-running
+#               `git cat-file --batch` process and `git diff-tree`, so
+#               backfills and benchmarks run at disk speed and repositories
+#               mirrored outside CodeCommit can be indexed too. A repository
+#               name resolves to GIT_REPOSITORIES_ROOT/<name>[.git], or is
+#               used as is when it already is a directory.
+#
+# Both backends return differences in the shape of CodeCommit's
+# get_differences, so the rest of the pipeline does not know which one it
+# is talking to. Blobs larger than TEMPLATE_MAX_BYTES are refused before
+# they are decoded (and, from git, before they are read at all).
+import os
+import threading
+
+from aws_clients import LazyClient
+
+REPOSITORY_SOURCE = os.environ.get('REPOSITORY_SOURCE', 'codecommit')
+GIT_REPOSITORIES_ROOT = os.environ.get('GIT_REPOSITORIES_ROOT', '.')
+
+# Upper bound on concurrent get_blob calls for a single push
+BLOB_FETCH_WORKERS = int(os.environ.get('BLOB_FETCH_WORKERS', '16'))
+
+# CloudFormation rejects template bodies over 1 MB, so a larger blob cannot declare a deployed function
+TEMPLATE_MAX_BYTES = int(os.environ.get('TEMPLATE_MAX_BYTES', str(2 ** 20)))
+
+# Differences per page from git, mirroring CodeCommit's paging
+GIT_PAGE_SIZE = 1000
+
+client = LazyClient('codecommit')
+
+_sources = {}
+_lock = threading.Lock()
+
+
+class UnreadableBlob(ValueError):
+    # The blob was fetched but cannot be a template; like a parse failure it is skipped
+    pass
+
+
+class TemplateTooLarge(UnreadableBlob):
+    pass
+
+
+def _decode(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise UnreadableBlob(f"not UTF-8: {e}")
+
+
+class CodeCommitSource:
+
+    def __init__(self, repository_name):
+        self.repository_name = repository_name
+
+    def parent_commit(self, commit_id):
+        response = client.get_commit(repositoryName=self.repository_name, commitId=commit_id)
+        parents = response['commit'].get('parents') or []
+        return parents[0] if parents else None
+
+    def is_ancestor(self, ancestor_commit_id, commit_id):
+        # GetMergeCommit reports the merge base of two commits without merging anything
+        response = client.get_merge_commit(
+            repositoryName=self.repository_name,
+            sourceCommitSpecifier=ancestor_commit_id,
+            destinationCommitSpecifier=commit_id
+        )
+        return response['baseCommitId'] == ancestor_commit_id
+
+    def difference_pages(self, before_commit_id, after_commit_id):
+        from concurrent.futures import ThreadPoolExecutor
+
+        def fetch_page(next_token):
+            kwargs = {
+                'repositoryName': self.repository_name,
+                'afterCommitSpecifier': after_commit_id
+            }
+            # Without a before commit CodeCommit diffs against the empty tree
+            if before_commit_id:
+                kwargs['beforeCommitSpecifier'] = before_commit_id
+            if next_token:
+                kwargs['NextToken'] = next_token
+            return client.get_differences(**kwargs)
+
+        # The next page is requested in the background while the caller works on the current one
+        with ThreadPoolExecutor(max_workers=1) as pager:
+            pending = pager.submit(fetch_page, None)
+            while pending is not None:
+                response = pending.result()
+                next_token = response.get('NextToken')
+                pending = pager.submit(fetch_page, next_token) if next_token else None
+                yield response.get('differences', [])
+
+    def blob_content(self, blob_id):
+        response = client.get_blob(repositoryName=self.repository_name, blobId=blob_id)
+        content = response['content']
+        if len(content) > TEMPLATE_MAX_BYTES:
+            raise TemplateTooLarge(f"{len(content)} bytes, limit is {TEMPLATE_MAX_BYTES}")
+        return _decode(content)
+
+    def iter_blob_contents(self, blob_ids):
+        # Yields (blob_id, content) as fetches complete; content is None for blobs that cannot be
+        # a template (see UnreadableBlob). Fetch errors are raised, since indexing the range
+        # without the blob would lose its functions for good. At most BLOB_FETCH_WORKERS blobs
+        # are in flight or waiting for the caller at once.
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        from itertools import islice
+
+        remaining = iter(blob_ids)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=BLOB_FETCH_WORKERS) as pool:
+            while True:
+                for blob_id in islice(remaining, BLOB_FETCH_WORKERS - len(pending)):
+                    pending[pool.submit(self.blob_content, blob_id)] = blob_id
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    blob_id = pending.pop(future)
+                    try:
+                        content = future.result()
+                    except UnreadableBlob as e:
+                        print(f"Unreadable blob {blob_id}: {str(e)}")
+                        content = None
+                    yield blob_id, content
+
+
+class GitSource:
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self._batch = None
+        self._batch_lock = threading.Lock()
+        self._empty_tree = None
+
+    def _git(self, *args, stdin=None):
+        # subprocess is imported on use, like boto3, to keep it off the handler's cold start
+        import subprocess
+
+        return subprocess.run(
+            ['git', '-C', self.git_dir, *args],
+            input=stdin, check=True, capture_output=True
+        ).stdout
+
+    def _read_object(self, specifier, max_bytes=None):
+        # Returns the object's bytes, or None when it does not exist
+        with self._batch_lock:
+            if self._batch is None or self._batch.poll() is not None:
+                import subprocess
+
+                self._batch = subprocess.Popen(
+                    ['git', '-C', self.git_dir, 'cat-file', '--batch'],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE
+                )
+            self._batch.stdin.write(specifier.encode('utf-8') + b'\n')
+            self._batch.stdin.flush()
+            header = self._batch.stdout.readline().rstrip(b'\n')
+            # '<id> <type> <size>', or '<specifier> missing' / '<specifier> ambiguous', where the
+            # specifier is echoed as given and may contain spaces
+            if header.endswith((b' missing', b' ambiguous')):
+                return None
+            size = int(header.rsplit(b' ', 1)[1])
+            if max_bytes is not None and size > max_bytes:
+                # The object still has to be drained from the pipe, but never in one piece
+                remaining = size + 1
+                while remaining:
+                    remaining -= len(self._batch.stdout.read(min(remaining, 2 ** 16)))
+                raise TemplateTooLarge(f"{size} bytes, limit is {max_bytes}")
+            data = self._batch.stdout.read(size)
+            self._batch.stdout.read(1)
+            return data
+
+    def parent_commit(self, commit_id):
+        import subprocess
+
+        try:
+            return self._git('rev-parse', '--verify', '--quiet', f'{commit_id}^').decode().strip() or None
+        except subprocess.CalledProcessError:
+            # The initial commit has no parent
+            return None
+
+    def is_ancestor(self, ancestor_commit_id, commit_id):
+        import subprocess
+
+        try:
+            self._git('merge-base', '--is-ancestor', ancestor_commit_id, commit_id)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def difference_pages(self, before_commit_id, after_commit_id):
+        if before_commit_id is None:
+            if self._empty_tree is None:
+                # Hashed rather than hard-coded so SHA-256 repositories work too
+                self._empty_tree = self._git('hash-object', '-t', 'tree', '--stdin', stdin=b'').decode().strip()
+            before_commit_id = self._empty_tree
+
+        output = self._git('diff-tree', '-r', '-z', '--no-renames', before_commit_id, after_commit_id)
+        fields = output.split(b'\0')
+        page = []
+        # Records are ':<old mode> <new mode> <old id> <new id> <status>' NUL '<path>' NUL
+        for index in range(0, len(fields) - 1, 2):
+            old_mode, new_mode, old_id, new_id, status = fields[index].lstrip(b':').decode().split(' ')
+            path = fields[index + 1].decode('utf-8', 'surrogateescape')
+            difference = {'changeType': status[0]}
+            # Zero modes mark the missing side; 160000 entries are submodules, not blobs
+            if old_mode not in ('000000', '160000'):
+                difference['beforeBlob'] = {'blobId': old_id, 'path': path, 'mode': old_mode}
+            if new_mode not in ('000000', '160000'):
+                difference['afterBlob'] = {'blobId': new_id, 'path': path, 'mode': new_mode}
+            page.append(difference)
+            if len(page) == GIT_PAGE_SIZE:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def blob_content(self, blob_id):
+        data = self._read_object(blob_id, TEMPLATE_MAX_BYTES)
+        if data is None:
+            raise KeyError(f"{blob_id} not in {self.git_dir}")
+        return _decode(data)
+
+    def iter_blob_contents(self, blob_ids):
+        # Yields (blob_id, content) one blob at a time; content is None for blobs that cannot be
+        # a template (see UnreadableBlob) and a missing object raises KeyError
+        for blob_id in blob_ids:
+            try:
+                content = self.blob_content(blob_id)
+            except UnreadableBlob as e:
+                print(f"Unreadable blob {blob_id}: {str(e)}")
+                content = None
+            yield blob_id, content
+
+
+def _git_directory(repository_name):
+    if os.path.isdir(repository_name):
+        return repository_name
+    for candidate in (repository_name, f'{repository_name}.git'):
+        path = os.path.join(GIT_REPOSITORIES_ROOT, candidate)
+        if os.path.isdir(path):
+            return path
+    raise FileNotFoundError(f"No git repository for {repository_name} under {GIT_REPOSITORIES_ROOT}")
+
+def get_source(repository_name):
+    # Sources are kept across warm invocations so the cat-file process stays open
+    key = (REPOSITORY_SOURCE, repository_name)
+    source = _sources.get(key)
+    if source is None:
+        with _lock:
+            source = _sources.get(key)
+            if source is None:
+                if REPOSITORY_SOURCE == 'git':
+                    source = GitSource(_git_directory(repository_name))
+                elif REPOSITORY_SOURCE == 'codecommit':
+                    source = CodeCommitSource(repository_name)
+                else:
+                    raise ValueError(f"Unknown REPOSITORY_SOURCE {REPOSITORY_SOURCE!r}")
+                _sources[key] = source
+    return source
@@ -0,0 +1,190 @@
+# Content-addressed cache of template blobs and their parsed Resources.
+#
+# Blob IDs are hashes of the content, so an entry never goes stale. Parsed
+# Resources live in an in-memory LRU that survives warm invocations. Both
+# kinds are kept in a size-bounded store under /tmp (Lambda's only writable
+# path, which also survives warm starts) so a recycled execution environment
+# or another handler in the same one does not download and re-parse the same
+# template. Raw content stays on disk only: it is just read again when a
+# parse is missing, and keeping it in memory would tie the Lambda's memory
+# to template sizes.
+# Hit and miss counters are reported with the invocation metrics.
+import os
+import threading
+from collections import OrderedDict
+
+TEMPLATE_CACHE_MAX_ENTRIES = int(os.environ.get('TEMPLATE_CACHE_MAX_ENTRIES', '1024'))
+
+# Set TEMPLATE_CACHE_DIR to '' to disable the on-disk level
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', '/tmp/template-cache')
+TEMPLATE_CACHE_DISK_BYTES = int(os.environ.get('TEMPLATE_CACHE_DISK_BYTES', str(256 * 2 ** 20)))
+
+# Fraction of the disk budget kept after an eviction pass, so eviction does not run on every write
+DISK_LOW_WATERMARK = 0.8
+
+_lock = threading.Lock()
+
+# Guards _disk_bytes and eviction; taken before _lock when both are needed, and no disk
+# I/O runs under _lock, so lookups never wait on a write or an eviction pass
+_disk_lock = threading.Lock()
+
+# Kinds held in the in-memory LRU as well as on disk
+MEMORY_KINDS = ('resources',)
+
+# (kind, blob_id) -> value, where kind is one of MEMORY_KINDS
+_entries = OrderedDict()
+
+# Bytes on disk; None until the directory has been scanned once
+_disk_bytes = None
+
+_stats = {}
+
+
+def _count(kind, outcome, amount=1):
+    key = f"{kind}_{outcome}"
+    _stats[key] = _stats.get(key, 0) + amount
+
+def _disk_path(kind, blob_id):
+    # Blob IDs are hex digests, so they are safe as file names
+    return os.path.join(TEMPLATE_CACHE_DIR, kind, blob_id[:2], blob_id)
+
+def _remember(key, value):
+    _entries[key] = value
+    _entries.move_to_end(key)
+    while len(_entries) > TEMPLATE_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _count('memory', 'evictions')
+
+def _scan_disk():
+    files = []
+    for root, _, names in os.walk(TEMPLATE_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+def _evict_disk():
+    # Called with _disk_lock held. Oldest-touched files go first; reads refresh the modification time
+    global _disk_bytes
+    files = sorted(_scan_disk())
+    _disk_bytes = sum(size for _, size, _ in files)
+    evictions = 0
+    for _, size, path in files:
+        if _disk_bytes <= TEMPLATE_CACHE_DISK_BYTES * DISK_LOW_WATERMARK:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        _disk_bytes -= size
+        evictions += 1
+    if evictions:
+        with _lock:
+            _count('disk', 'evictions', evictions)
+
+def _read_disk(kind, blob_id):
+    import pickle
+
+    path = _disk_path(kind, blob_id)
+    try:
+        with open(path, 'rb') as cache_file:
+            value = pickle.load(cache_file)
+        os.utime(path)
+        return value
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A truncated or unreadable entry is treated as a miss and rewritten
+        print(f"Discarding cache entry {path}: {e}")
+        return None
+
+def _write_disk(kind, blob_id, value):
+    import pickle
+
+    global _disk_bytes
+    path = _disk_path(kind, blob_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > TEMPLATE_CACHE_DISK_BYTES * DISK_LOW_WATERMARK:
+            return
+        # Written under a temporary name so concurrent readers never see a partial file
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, 'wb') as cache_file:
+            cache_file.write(payload)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        print(f"Could not write cache entry {path}: {e}")
+        return
+
+    with _disk_lock:
+        if _disk_bytes is None:
+            _disk_bytes = sum(size for _, size, _ in _scan_disk())
+        else:
+            _disk_bytes += len(payload)
+        if _disk_bytes > TEMPLATE_CACHE_DISK_BYTES:
+            _evict_disk()
+
+def _get(kind, blob_id):
+    key = (kind, blob_id)
+    with _lock:
+        if kind in MEMORY_KINDS and key in _entries:
+            _entries.move_to_end(key)
+            _count(kind, 'memory_hits')
+            return _entries[key]
+
+    value = _read_disk(kind, blob_id) if TEMPLATE_CACHE_DIR else None
+    with _lock:
+        if value is None:
+            _count(kind, 'misses')
+            return None
+        _count(kind, 'disk_hits')
+        if kind in MEMORY_KINDS:
+            _remember(key, value)
+    return value
+
+def _put(kind, blob_id, value):
+    if kind in MEMORY_KINDS:
+        with _lock:
+            _remember((kind, blob_id), value)
+    if TEMPLATE_CACHE_DIR:
+        # Writers use their own temporary files, so only the size accounting is serialised
+        _write_disk(kind, blob_id, value)
+
+def get_content(blob_id):
+    return _get('content', blob_id)
+
+def put_content(blob_id, content):
+    _put('content', blob_id, content)
+
+def get_resources(blob_id):
+    return _get('resources', blob_id)
+
+def put_resources(blob_id, resources):
+    _put('resources', blob_id, resources)
+
+def cache_stats(reset=False):
+    with _lock:
+        stats = dict(_stats, memory_entries=len(_entries), disk_bytes=_disk_bytes or 0)
+        if reset:
+            _stats.clear()
+        return stats
+
+def reset_cache_stats():
+    with _lock:
+        _stats.clear()
+
+def clear_cache(disk=False):
+    global _disk_bytes
+    import shutil
+
+    with _disk_lock, _lock:
+        _entries.clear()
+        _stats.clear()
+        if disk and TEMPLATE_CACHE_DIR:
+            shutil.rmtree(TEMPLATE_CACHE_DIR, ignore_errors=True)
+            _disk_bytes = 0
@@ -0,0 +1,73 @@
+# Structural diff of the Lambda functions declared by a CloudFormation template.
+#
+# Both sides of a changed template are parsed once and their Resources maps
+# compared, instead of scraping FunctionName out of changed text lines.
+# Formatting, comment and unrelated property edits therefore produce no
+# changes at all, and a function is reported exactly once no matter how many
+# of its lines moved.
+
+
+def handler_table_name(handler):
+    # 'orders.lambda_handler' is indexed in the 'orders' handler table
+    return handler.split('.')[0]
+
+def template_folder_name(file_path):
+    # 'stacks/orders/template.yml' -> 'template'
+    return file_path.split('/')[-1].split('.')[0]
+
+def handler_functions(resources):
+    # Returns function_name -> (logical_id, handler table) for every resource with a Handler
+    functions = {}
+    for logical_id, resource in (resources or {}).items():
+        properties = resource.get('Properties') if isinstance(resource, dict) else None
+        if not isinstance(properties, dict) or 'Handler' not in properties:
+            continue
+
+        handler = properties['Handler']
+        function_name = properties.get('FunctionName')
+        # Intrinsics such as !Sub only resolve at deploy time, so there is no literal name to index
+        if not isinstance(handler, str) or not isinstance(function_name, str):
+            print(f"Skipping resource {logical_id}: Handler or FunctionName is not a literal string")
+            continue
+
+        functions[function_name] = (logical_id, handler_table_name(handler))
+    return functions
+
+def diff_template_functions(before_resources, after_resources):
+    # Either side may be None for an added or deleted template. Returns lists of
+    #   added:   (function_name, table_name)
+    #   removed: (function_name, table_name)
+    #   changed: (function_name, old_table_name, new_table_name)   handler moved
+    #   renamed: (old_function_name, new_function_name, old_table_name, new_table_name)
+    if before_resources == after_resources:
+        return {'added': [], 'removed': [], 'changed': [], 'renamed': []}
+
+    before = handler_functions(before_resources)
+    after = handler_functions(after_resources)
+
+    removed = {name: before[name] for name in before.keys() - after.keys()}
+    added = {name: after[name] for name in after.keys() - before.keys()}
+    changed = sorted(
+        (name, before[name][1], after[name][1])
+        for name in before.keys() & after.keys()
+        if before[name][1] != after[name][1]
+    )
+
+    # A resource that kept its logical ID but changed its FunctionName was renamed
+    removed_by_id = {logical_id: name for name, (logical_id, _) in removed.items()}
+    renamed = []
+    for new_name, (logical_id, new_table) in sorted(added.items()):
+        old_name = removed_by_id.get(logical_id)
+        if old_name is not None:
+            renamed.append((old_name, new_name, removed.pop(old_name)[1], new_table))
+            del added[new_name]
+
+    return {
+        'added': sorted((name, table_name) for name, (_, table_name) in added.items()),
+        'removed': sorted((name, table_name) for name, (_, table_name) in removed.items()),
+        'changed': changed,
+        'renamed': renamed
+    }
+
+def diff_is_empty(function_diff):
+    return not any(function_diff.values())
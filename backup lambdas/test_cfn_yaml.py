@@ -0,0 +1,188 @@
+# load_handler_resources reads the parser's events and falls back to the full
+# parse for what they cannot answer alone; both paths must agree.
+#
+#   python -m pytest test_cfn_yaml.py
+import pytest
+
+from cfn_yaml import _FullParseRequired, _stream_handler_resources, handler_resources, load_handler_resources, load_template
+
+
+def full_parse(template_text):
+    return handler_resources(load_template(template_text)['Resources'])
+
+
+TEMPLATES = {
+    'plain': """
+Resources:
+  Api:
+    Type: AWS::Serverless::Function
+    Properties:
+      Handler: api.handler
+      FunctionName: api
+      Runtime: python3.12
+      Events:
+        Get: {Type: Api, Properties: {Path: /, Method: get}}
+  Bucket:
+    Type: AWS::S3::Bucket
+    Properties:
+      BucketName: data
+  NoProperties:
+    Type: AWS::SNS::Topic
+""",
+    'scalar_anchors': """
+Globals:
+  Function:
+    Handler: &handler shared.handler
+Resources:
+  First:
+    Properties:
+      Handler: *handler
+      FunctionName: &name first
+  Second:
+    Properties:
+      Handler: second.handler
+      FunctionName: *name
+""",
+    'aliased_mapping': """
+Resources:
+  First: &function
+    Properties:
+      Handler: app.handler
+      FunctionName: first
+  Second: *function
+""",
+    'merge_key': """
+Resources:
+  First:
+    Properties: &defaults
+      Handler: app.handler
+      Runtime: python3.12
+  Second:
+    Properties:
+      <<: *defaults
+      FunctionName: second
+""",
+    'duplicate_resources_key': """
+Resources:
+  Old:
+    Properties:
+      Handler: old.handler
+Resources:
+  New:
+    Properties:
+      Handler: new.handler
+""",
+    'duplicate_logical_id': """
+Resources:
+  Api:
+    Properties:
+      Handler: first.handler
+      FunctionName: api
+  Api:
+    Properties:
+      Handler: second.handler
+      FunctionName: api
+  Dropped:
+    Properties:
+      Handler: dropped.handler
+  Dropped:
+    Type: AWS::SNS::Topic
+""",
+    'duplicate_property': """
+Resources:
+  Api:
+    Properties:
+      Handler: first.handler
+      Handler: second.handler
+""",
+    'quoted_scalars': """
+Resources:
+  Api:
+    Properties:
+      Handler: '123'
+      FunctionName: "true"
+  Tagged:
+    Properties:
+      Handler: !!str 1.5
+""",
+    'non_string_scalars': """
+Resources:
+  Number:
+    Properties:
+      Handler: 123
+      FunctionName: true
+  Empty:
+    Properties:
+      Handler: ~
+      FunctionName:
+  Sequence:
+    Properties:
+      Handler: [a, b]
+      FunctionName: {Name: nested}
+""",
+    'intrinsic_tags': """
+Resources:
+  Sub:
+    Properties:
+      Handler: !Sub '${Prefix}.handler'
+      FunctionName: !Ref FunctionNameParameter
+  GetAtt:
+    Properties:
+      Handler: index.handler
+      FunctionName: !GetAtt Names.Api
+  Long:
+    Properties:
+      Handler: {'Fn::Sub': '${Prefix}.handler'}
+      FunctionName: long
+""",
+    'json': """
+{
+  "AWSTemplateFormatVersion": "2010-09-09",
+  "Resources": {
+    "Api": {
+      "Type": "AWS::Lambda::Function",
+      "Properties": {"Handler": "api.handler", "FunctionName": "api", "Code": {"ZipFile": "pass"}}
+    },
+    "Number": {"Properties": {"Handler": 1}}
+  }
+}
+""",
+    'resources_null': """
+Resources:
+""",
+}
+
+
+@pytest.mark.parametrize('name', sorted(TEMPLATES))
+def test_matches_full_parse(name):
+    template_text = TEMPLATES[name]
+    assert load_handler_resources(template_text) == full_parse(template_text)
+
+
+@pytest.mark.parametrize('name', ['aliased_mapping', 'merge_key', 'resources_null'])
+def test_falls_back_to_full_parse(name):
+    with pytest.raises(_FullParseRequired):
+        _stream_handler_resources(TEMPLATES[name])
+
+
+@pytest.mark.parametrize('name', ['plain', 'scalar_anchors', 'duplicate_logical_id', 'intrinsic_tags', 'json'])
+def test_streams_without_full_parse(name):
+    assert _stream_handler_resources(TEMPLATES[name]) == full_parse(TEMPLATES[name])
+
+
+def test_without_resources():
+    assert load_handler_resources("AWSTemplateFormatVersion: '2010-09-09'\n") == {}
+
+
+@pytest.mark.parametrize('template_text', ['', '# only a comment\n', '---\n'])
+def test_empty_document_is_unusable(template_text):
+    # Both paths fail, so the template is reported as unparseable rather than as empty
+    with pytest.raises(Exception):
+        full_parse(template_text)
+    with pytest.raises(Exception):
+        load_handler_resources(template_text)
+
+
+def test_invalid_yaml_raises():
+    with pytest.raises(Exception):
+        load_handler_resources("Resources: [\n")
@@ -0,0 +1,40 @@
+# The lookup endpoints of hello.py against the in-memory fakes of fake_aws (see conftest.py).
+#
+#   python -m pytest test_hello.py
+import pytest
+
+import automatedscript_ostrum
+import function_lookup
+import hello
+from bench_handler import REPOSITORY
+from conftest import template
+
+
+@pytest.fixture
+def client(fakes, monkeypatch):
+    codecommit, _ = fakes
+    monkeypatch.setattr(function_lookup, 'LOOKUP_CACHE_TTL', 0)
+    function_lookup._entries.clear()
+    function_lookup._version['value'] = None
+    codecommit.add_commit('c0', {'a/template.yml': template(('f1', 'app.handler'))})
+    automatedscript_ostrum.process_push(REPOSITORY, 'refs/heads/main', ['c0'], {'resources': {}})
+    return hello.app.test_client()
+
+
+def test_repeat_lookup_of_a_known_function_is_not_modified(client):
+    response = client.get('/functions/f1')
+    assert response.status_code == 200
+    repeat = client.get('/functions/f1', headers={'If-None-Match': response.headers['ETag']})
+    assert repeat.status_code == 304
+
+
+def test_unknown_function_is_never_not_modified(client):
+    response = client.get('/functions/unknown')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+    repeat = client.get('/functions/unknown', headers={'If-None-Match': '*'})
+    assert repeat.status_code == 404
+
+
+def test_index_version_name_is_unknown(client):
+    assert client.get('/functions/%23index_version').status_code == 404
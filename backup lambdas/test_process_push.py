@@ -0,0 +1,71 @@
+# process_push against the in-memory fakes of fake_aws (see conftest.py).
+#
+#   python -m pytest test_process_push.py
+import pytest
+
+import automatedscript_ostrum
+import checkpoints
+import fake_aws
+from bench_handler import REPOSITORY
+from conftest import indexed, template
+
+
+def push(*commits):
+    return automatedscript_ostrum.process_push(REPOSITORY, 'refs/heads/main', list(commits), {'resources': {}})
+
+
+def test_late_push_of_an_older_head_is_skipped(fakes):
+    codecommit, dynamodb = fakes
+    codecommit.add_commit('c0', {'a/template.yml': template(('f0', 'app.handler'))})
+    codecommit.add_commit('c1', {'a/template.yml': template(('f0', 'app.handler'), ('f1', 'app.handler'))}, parent='c0')
+    codecommit.add_commit('c2', {'a/template.yml': template(
+        ('f0', 'app.handler'), ('f1', 'app.handler'), ('f2', 'app.handler')
+    )}, parent='c1')
+
+    assert push('c0') == 'processed'
+    assert push('c2') == 'processed'
+    # Delivered after c2 although c2 already contains it
+    assert push('c1') == 'skipped'
+
+    assert indexed(dynamodb) == {('app', 'f0'), ('app', 'f1'), ('app', 'f2')}
+    assert checkpoints.read_checkpoint(REPOSITORY, 'main')['commit_id'] == 'c2'
+
+
+def test_every_head_of_a_coalesced_push_is_recorded(fakes):
+    codecommit, dynamodb = fakes
+    codecommit.add_commit('c0', {'a/template.yml': template(('f0', 'app.handler'))})
+    codecommit.add_commit('c1', {'a/template.yml': template(('f1', 'app.handler'))}, parent='c0')
+    codecommit.add_commit('c2', {'a/template.yml': template(('f2', 'app.handler'))}, parent='c1')
+
+    assert push('c0') == 'processed'
+    assert push('c1', 'c2') == 'processed'
+
+    checkpoint = checkpoints.read_checkpoint(REPOSITORY, 'main')
+    assert checkpoint['recent_commits'][:3] == ['c2', 'c1', 'c0']
+    assert push('c1') == 'skipped'
+    assert indexed(dynamodb) == {('app', 'f2')}
+
+
+def test_template_fixed_after_invalid_yaml_is_registered(fakes):
+    codecommit, dynamodb = fakes
+    codecommit.add_commit('c0', {'a/template.yml': template(('f1', 'app.handler'))})
+    codecommit.add_commit('c1', {'a/template.yml': 'Resources: [\n'}, parent='c0')
+    codecommit.add_commit('c2', {'a/template.yml': template(('f1', 'app.handler'), ('f2', 'app.handler'))}, parent='c1')
+
+    for commit_id in ('c0', 'c1', 'c2'):
+        assert push(commit_id) == 'processed'
+
+    assert indexed(dynamodb) == {('app', 'f1'), ('app', 'f2')}
+
+
+def test_handler_table_creation_failure_fails_the_push(fakes, monkeypatch):
+    codecommit, dynamodb = fakes
+    codecommit.add_commit('c0', {'a/template.yml': template(('f1', 'app.handler'))})
+
+    def create_table(**kwargs):
+        raise fake_aws._error_class('LimitExceededException')('too many tables', 'CreateTable')
+
+    monkeypatch.setattr(dynamodb, 'create_table', create_table)
+    with pytest.raises(Exception, match='too many tables'):
+        push('c0')
+    assert checkpoints.read_checkpoint(REPOSITORY, 'main')['commit_id'] is None
@@ -0,0 +1,54 @@
+# Webhook batches against the in-memory fakes of fake_aws (see conftest.py).
+#
+#   python -m pytest test_webhook_ingest.py
+import pytest
+
+import webhook_ingest
+from bench_handler import push_event
+from conftest import indexed, template
+
+
+@pytest.fixture
+def ingest(fakes, monkeypatch):
+    monkeypatch.setattr(webhook_ingest, 'WEBHOOK_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(webhook_ingest, 'WEBHOOK_MAX_ATTEMPTS', 2)
+    webhook_ingest._dead_letters.clear()
+    return fakes
+
+
+def test_bad_push_does_not_fail_the_good_push_batched_with_it(ingest):
+    codecommit, dynamodb = ingest
+    codecommit.add_commit('c0', {'a/template.yml': template(('f1', 'app.handler'))})
+    codecommit.add_commit('c1', {'a/template.yml': template(('f1', 'app.handler'), ('f2', 'app.handler'))}, parent='c0')
+    webhook_ingest.enqueue_event(push_event('c0'))
+    webhook_ingest.wait_until_idle()
+
+    # Back to back, so both land in one batch and are merged into one branch update
+    webhook_ingest.enqueue_event(push_event('c1'))
+    webhook_ingest.enqueue_event(push_event('missing'))
+    webhook_ingest.wait_until_idle()
+
+    assert indexed(dynamodb) == {('app', 'f1'), ('app', 'f2')}
+    dead_letters = webhook_ingest.ingest_stats()['dead_letters']
+    assert [(letter['commits'], letter['attempts']) for letter in dead_letters] == [(['missing'], 2)]
+
+
+def test_failed_push_is_retried(ingest):
+    codecommit, dynamodb = ingest
+    codecommit.add_commit('c0', {'a/template.yml': template(('f1', 'app.handler'))})
+    get_blob = codecommit.get_blob
+    failures = []
+
+    def get_blob_once(**kwargs):
+        if not failures:
+            failures.append(kwargs['blobId'])
+            raise codecommit._error('BlobIdDoesNotExistException', 'not yet replicated', 'GetBlob')
+        return get_blob(**kwargs)
+
+    codecommit.get_blob = get_blob_once
+    webhook_ingest.enqueue_event(push_event('c0'))
+    webhook_ingest.wait_until_idle()
+
+    assert failures
+    assert indexed(dynamodb) == {('app', 'f1')}
+    assert webhook_ingest.ingest_stats()['dead_letters'] == []
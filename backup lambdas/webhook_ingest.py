@@ -0,0 +1,248 @@
+# Long-running ingestion of CodeCommit push events for the Flask app in hello.py.
+#
+# POST /webhooks/codecommit accepts the same payload lambda_handler parses and
+# only enqueues it. Every branch is pinned to one worker thread, so its pushes
+# are applied in order. Each worker has a bounded queue; when it is full, the
+# request is refused with 503 instead of buffering without limit.
+#
+# A worker waits for a push, then keeps collecting for up to
+# WEBHOOK_BATCH_WINDOW seconds or WEBHOOK_BATCH_SIZE pushes. Pushes to the
+# same branch are then merged: one diff from the first commit's parent (or
+# the checkpoint) to the last head covers all of them, so a burst of pushes
+# costs one diff per branch instead of one per push.
+#
+# The sender already got a 202, so failures are never dropped. When a merged
+# branch update fails, its pushes are applied again one by one, so one bad
+# head does not fail the pushes batched with it. A push that still fails is
+# requeued after WEBHOOK_RETRY_DELAY seconds, doubled per attempt, and after
+# WEBHOOK_MAX_ATTEMPTS attempts it is kept as a dead letter that
+# /webhooks/status lists. Checkpoints skip a retried push that a later one
+# already covered.
+#
+# Every batch emits one metrics record like lambda_handler's. The counters are
+# shared by all workers, so each record drains what was counted since the
+# previous one, whichever worker made the calls.
+import collections
+import os
+import queue
+import threading
+import time
+import zlib
+
+from automatedscript_ostrum import coalesce_push_refs, process_pushes
+from aws_metrics import emit_metrics
+from rate_limiter import limiter_stats
+from template_cache import cache_stats
+
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '100'))
+WEBHOOK_BATCH_WINDOW = float(os.environ.get('WEBHOOK_BATCH_WINDOW', '0.5'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '5'))
+WEBHOOK_RETRY_DELAY = float(os.environ.get('WEBHOOK_RETRY_DELAY', '2'))
+
+# Most recent pushes that exhausted their attempts
+WEBHOOK_DEAD_LETTERS = int(os.environ.get('WEBHOOK_DEAD_LETTERS', '1000'))
+
+_lock = threading.Lock()
+_queues = []
+_dead_letters = collections.deque(maxlen=WEBHOOK_DEAD_LETTERS)
+
+_stats = {
+    'accepted': 0,
+    'rejected': 0,
+    'batches': 0,
+    'pushes_applied': 0,
+    'branches_applied': 0,
+    'failed': 0,
+    'retried': 0,
+    'retrying': 0,
+    'dead_lettered': 0,
+}
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+def _worker_index(repository, ref):
+    # crc32 rather than hash() so the assignment does not change between processes
+    return zlib.crc32(f"{repository}#{ref}".encode('utf-8')) % len(_queues)
+
+def _next_batch(work_queue):
+    # Blocks for the first push, then gathers more until the window closes or the batch is full
+    batch = [work_queue.get()]
+    deadline = time.monotonic() + WEBHOOK_BATCH_WINDOW
+    while len(batch) < WEBHOOK_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(work_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def merge_pushes(batch):
+    # (repository, ref, commits, attempt) items -> {(repository, ref): commits}, keeping push order
+    pushes = {}
+    for repository, ref, commits, _ in batch:
+        merged = pushes.setdefault((repository, ref), [])
+        merged.extend(commit_id for commit_id in commits if commit_id not in merged)
+    return pushes
+
+def _emit_batch_metrics(batch, outcomes, started):
+    try:
+        emit_metrics(
+            properties={
+                'outcomes': outcomes,
+                'pushes': len(batch),
+                'batch_ms': round((time.perf_counter() - started) * 1000, 2),
+                'template_cache': cache_stats(reset=True),
+                'rate_limiter': limiter_stats(reset=True)
+            },
+            reset=True
+        )
+    except Exception as e:
+        print(f"Failed to emit webhook batch metrics: {e}")
+
+def _dead_letter(item, error):
+    repository, ref, commits, attempt = item
+    print(f"Giving up on {repository} {ref} {commits[-1]} after {attempt + 1} attempts: {error}")
+    with _lock:
+        _stats['dead_lettered'] += 1
+        _dead_letters.append({
+            'repository': repository, 'ref': ref, 'commits': commits, 'attempts': attempt + 1, 'error': error
+        })
+
+def _requeue(item):
+    repository, ref, commits, attempt = item
+    try:
+        _queues[_worker_index(repository, ref)].put_nowait((repository, ref, commits, attempt + 1))
+    except queue.Full:
+        _dead_letter(item, 'queue full when retrying')
+    finally:
+        _count('retrying', -1)
+
+def _retry_later(item, error):
+    attempt = item[3]
+    if attempt + 1 >= WEBHOOK_MAX_ATTEMPTS:
+        _dead_letter(item, error)
+        return
+    delay = WEBHOOK_RETRY_DELAY * 2 ** attempt
+    print(f"Retrying {item[0]} {item[1]} {item[2][-1]} in {delay}s: {error}")
+    with _lock:
+        _stats['retried'] += 1
+        _stats['retrying'] += 1
+    timer = threading.Timer(delay, _requeue, args=(item,))
+    timer.daemon = True
+    timer.start()
+
+def _failure(outcomes):
+    # Returns the error of the first failed outcome, or None
+    for outcome in outcomes:
+        if outcome['status'] == 'failed':
+            return outcome.get('error', 'failed')
+    return None
+
+def _apply_batch(batch):
+    # Returns the outcomes of the batch; pushes that failed are scheduled for a retry
+    pushes = merge_pushes(batch)
+    merged_outcomes = process_pushes(pushes, [])
+    failed = {
+        (outcome['repository'], outcome['ref']) for outcome in merged_outcomes if outcome['status'] == 'failed'
+    }
+    outcomes = [outcome for outcome in merged_outcomes if (outcome['repository'], outcome['ref']) not in failed]
+
+    for item in batch:
+        repository, ref, commits, _ = item
+        if (repository, ref) not in failed:
+            continue
+        if pushes[(repository, ref)] == commits:
+            # The merged update was this push alone
+            push_outcomes = [
+                outcome for outcome in merged_outcomes if (outcome['repository'], outcome['ref']) == (repository, ref)
+            ]
+        else:
+            push_outcomes = process_pushes({(repository, ref): commits}, [])
+        outcomes.extend(push_outcomes)
+        error = _failure(push_outcomes)
+        if error is not None:
+            _retry_later(item, error)
+
+    _count('batches')
+    _count('pushes_applied', len(batch))
+    _count('branches_applied', len(pushes))
+    return outcomes
+
+def _work(work_queue):
+    while True:
+        batch = _next_batch(work_queue)
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            outcomes = _apply_batch(batch)
+            failed = sum(outcome['status'] == 'failed' for outcome in outcomes)
+            _count('failed', failed)
+            print(f"Applied {len(batch)} pushes, {failed} commits failed")
+        except Exception as e:
+            # A worker must survive anything a batch throws at it
+            print(f"Webhook batch of {len(batch)} pushes failed: {e}")
+            _count('failed', len(batch))
+            for item in batch:
+                _retry_later(item, str(e))
+        finally:
+            _emit_batch_metrics(batch, outcomes, started)
+            for _ in batch:
+                work_queue.task_done()
+
+def start_workers():
+    with _lock:
+        if _queues:
+            return
+        for _ in range(WEBHOOK_WORKERS):
+            work_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+            _queues.append(work_queue)
+            threading.Thread(target=_work, args=(work_queue,), daemon=True).start()
+
+def enqueue_event(event):
+    # Returns the number of branch pushes queued; raises ValueError for malformed payloads
+    # and QueueFull when a worker's queue has no room
+    try:
+        pushes = coalesce_push_refs(event)
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        raise ValueError(f"Not a CodeCommit push event: {e!r}")
+
+    start_workers()
+    queued = 0
+    for (repository, ref), commits in pushes.items():
+        try:
+            _queues[_worker_index(repository, ref)].put_nowait((repository, ref, commits, 0))
+        except queue.Full:
+            _count('rejected')
+            raise QueueFull(f"Queue for {repository} {ref} is full")
+        _count('accepted')
+        queued += 1
+    return queued
+
+def wait_until_idle():
+    # Pushes waiting for their retry count as pending work
+    while True:
+        for work_queue in list(_queues):
+            work_queue.join()
+        with _lock:
+            if not _stats['retrying']:
+                return
+        time.sleep(0.05)
+
+def ingest_stats():
+    with _lock:
+        return dict(
+            _stats,
+            queued=[work_queue.qsize() for work_queue in _queues],
+            dead_letters=list(_dead_letters)
+        )